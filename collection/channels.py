@@ -1,15 +1,59 @@
 from __future__ import annotations
 
+import threading
+import time
+from typing import Optional
+
+from constants import serverPackets
 from helpers import chatHelper as chat
 from logger import log
 from objects import channel
 from objects import glob
 
 
+# Seconds the channel info bundle is reused for before its member counts are refreshed
+INFO_BUNDLE_INTERVAL = 5
+
+
 class ChannelList:
     def __init__(self):
         self.channels = {}
 
+        # channel_info packets of every public channel, sent on login
+        self._infoBundle: Optional[bytes] = None
+        self._infoBundleTime = 0.0
+        self._infoBundleLock = threading.Lock()
+
+    def getInfoBundle(self):
+        """
+        Get the channel_info packets of every public channel, as sent on login.
+        Built at most once every INFO_BUNDLE_INTERVAL seconds, so member counts
+        may lag a bit behind, and right away after channels are added or removed.
+
+        :return: channel_info packets
+        """
+        with self._infoBundleLock:
+            if (
+                self._infoBundle is None
+                or time.time() - self._infoBundleTime > INFO_BUNDLE_INTERVAL
+            ):
+                self._infoBundle = b"".join(
+                    serverPackets.channel_info(channel.name)
+                    for channel in tuple(self.channels.values())
+                    if channel.publicRead and not channel.hidden
+                )
+                self._infoBundleTime = time.time()
+            return self._infoBundle
+
+    def invalidateInfoBundle(self):
+        """
+        Rebuild the channel info bundle on next use
+
+        :return:
+        """
+        with self._infoBundleLock:
+            self._infoBundle = None
+
     def loadChannels(self):
         """
         Load chat channels from db and add them to channels list
@@ -19,6 +63,7 @@ class ChannelList:
         channels = glob.db.fetchAll("SELECT * FROM bancho_channels")
 
         # Add each channel if needed
+        self.invalidateInfoBundle()
         for i in channels:
             if i["name"] not in self.channels:
                 publicRead = True if i["public_read"] == 1 else False
@@ -54,6 +99,8 @@ class ChannelList:
             temp,
             hidden,
         )
+        if publicRead and not hidden:
+            self.invalidateInfoBundle()
         log.info(f"Created channel {name}")
 
     def addTempChannel(self, name):
@@ -97,14 +144,16 @@ class ChannelList:
         # glob.streams.broadcast("chat/{}".format(name), serverPackets.channel_kicked(name))
         stream = glob.streams.getStream(f"chat/{name}")
         if stream is not None:
-            for token in stream.clients:
-                if token in glob.tokens.tokens:
+            for token in tuple(stream.clients.values()):
+                if not token.deleted:
                     chat.partChannel(
                         channel=name,
-                        token=glob.tokens.tokens[token],
+                        token=token,
                         kick=True,
                     )
         glob.streams.dispose(f"chat/{name}")
         glob.streams.remove(f"chat/{name}")
-        self.channels.pop(name)
+        removed = self.channels.pop(name)
+        if removed.publicRead and not removed.hidden:
+            self.invalidateInfoBundle()
         log.info(f"Removed channel {name}")
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-import threading
 import time
 
 from constants import serverPackets
 from constants.exceptions import periodicLoopException
+from helpers.expiry_helper import ExpiryHeap
 from logger import log
 from objects import glob
 from objects.match import Match
 
+# Seconds an empty match is kept around after being created
+EMPTY_MATCH_TIMEOUT = 120
+
 
 class MatchList:
     def __init__(self):
@@ -16,6 +19,9 @@ class MatchList:
         self.matches: dict[int, Match] = {}
         self.lastID = 1
 
+        # Cleanup deadlines of empty matches by match ID
+        self.emptyTimeouts = ExpiryHeap()
+
     def createMatch(
         self,
         matchName: str,
@@ -53,8 +59,25 @@ class MatchList:
             hostUserID,
             isTourney,
         )
+
+        # Matches are created empty, the host joins right after
+        self.scheduleEmpty(self.matches[matchID])
         return matchID
 
+    def scheduleEmpty(self, match: Match) -> None:
+        """
+        Schedule the cleanup of a match that just became empty.
+        It's disposed once it's been created more than 120 seconds ago,
+        unless someone joins before.
+
+        :param match: match object
+        :return:
+        """
+        self.emptyTimeouts.schedule(
+            match.matchID,
+            max(match.createTime + EMPTY_MATCH_TIMEOUT, int(time.time())),
+        )
+
     def match_dispose(self, matchID: int) -> None:
         """
         Destroy match object with id = matchID
@@ -92,45 +115,36 @@ class MatchList:
         # Send match dispose packet to everyone in lobby
         glob.streams.broadcast("lobby", serverPackets.match_dispose(matchID))
         del self.matches[matchID]
+        self.emptyTimeouts.cancel(matchID)
         log.info(f"MPROOM{matchID}: Room disposed manually")
 
-    def cleanupLoop(self) -> None:
+    def cleanup(self) -> None:
         """
-        Start match cleanup loop.
-        Empty matches that have been created more than 60 seconds ago will get deleted.
+        Delete empty matches that have been created more than 120 seconds ago.
         Useful when people create useless lobbies with `!mp make`.
-        The check is done every 30 seconds.
-        This method starts an infinite loop, call it only once!
+        Only matches whose cleanup deadline passed are checked.
+        Runs every 5 seconds, scheduled by glob.scheduler.
+
         :return:
         """
-        try:
-            log.debug("Checking empty matches")
-            t = int(time.time())
-            emptyMatches = []
-            exceptions = []
-
-            # Collect all empty matches
-            for m in self.matches.values():
-                if [x for x in m.slots if x.user is not None]:
-                    continue
-                if t - m.createTime >= 120:
-                    log.debug(f"Match #{m.matchID} marked for cleanup")
-                    emptyMatches.append(m.matchID)
-
-            # Dispose all empty matches
-            for matchID in emptyMatches:
-                try:
-                    self.match_dispose(matchID)
-                except Exception as e:
-                    exceptions.append(e)
-                    log.error(
-                        "Something wrong happened while disposing a timed out match. Reporting to Sentry when "
-                        "the loop ends.",
-                    )
-
-            # Re-raise exception if needed
-            if exceptions:
-                raise periodicLoopException(exceptions)
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(30, self.cleanupLoop).start()
+        exceptions = []
+
+        # Dispose all empty matches
+        for matchID in self.emptyTimeouts.pop_expired(int(time.time())):
+            m = self.matches.get(matchID)
+            if m is None or m.countUsers() != 0:
+                continue
+
+            log.debug(f"Match #{matchID} marked for cleanup")
+            try:
+                self.match_dispose(matchID)
+            except Exception as e:
+                exceptions.append(e)
+                log.error(
+                    "Something wrong happened while disposing a timed out match. Reporting to Sentry when "
+                    "the loop ends.",
+                )
+
+        # Re-raise exception if needed
+        if exceptions:
+            raise periodicLoopException(exceptions)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from typing import Container
 from typing import Optional
 from typing import TYPE_CHECKING
 
@@ -32,9 +33,8 @@ class StreamList:
         :return: Whether a stream actually got nuked
         """
         if name in self.streams:
-            for i in self.streams[name].clients:
-                if t := glob.tokens.tokens.get(i):
-                    t.leaveStream(name)
+            for t in tuple(self.streams[name].clients.values()):
+                t.leaveStream(name)
             self.streams.pop(name)
             return True
 
@@ -80,14 +80,14 @@ class StreamList:
         self,
         streamName: str,
         data: bytes,
-        but: Optional[list[str]] = None,
+        but: Optional[Container[str]] = None,
     ) -> None:
         """
         Send some data to all clients in a stream
 
         :param streamName: stream name
         :param data: data to send
-        :param but: array of tokens to ignore. Default: None (send to everyone)
+        :param but: set of tokens to ignore. Default: None (send to everyone)
         :return:
         """
         if streamName not in self.streams:
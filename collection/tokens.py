@@ -2,25 +2,43 @@ from __future__ import annotations
 
 import threading
 import time
+import traceback
 from typing import Optional
 
 import redis
-from common.ripple import userUtils
 
 from constants import serverPackets
-from constants.exceptions import periodicLoopException
 from events import logoutEvent
+from helpers.expiry_helper import ExpiryHeap
+from helpers.user_helper import fetch_user_data
 from helpers.user_helper import username_safe
 from logger import log
 from objects import glob
 from objects.osuToken import UserToken
 
+# Seconds without a ping before a client is disconnected
+CLIENT_TIMEOUT = 100
+
 
 class TokenList:
     def __init__(self):
         self.tokens: dict[str, UserToken] = {}
         self._lock = threading.Lock()
 
+        # Secondary indexes. A user may have more than one token
+        # (tournament clients), so both map to a list of tokens
+        self._userIDIndex: dict[int, list[UserToken]] = {}
+        self._usernameIndex: dict[str, list[UserToken]] = {}
+
+        # IDs of the users visible in the presence bundle sent at login
+        # (insertion ordered) and the last encoded bundle packet
+        self._presenceUserIDs: dict[int, None] = {}
+        self._presenceBundle: Optional[bytes] = None
+
+        # Timeout deadlines by token string. Entries aren't moved on every
+        # ping, the ping time is checked again when they expire.
+        self.timeouts = ExpiryHeap()
+
     def __enter__(self):
         self._lock.acquire()
 
@@ -34,6 +52,7 @@ class TokenList:
         irc=False,
         timeOffset: int = 0,
         tournament: bool = False,
+        userData: Optional[dict] = None,
     ) -> UserToken:
         """
         Add a token object to tokens list
@@ -43,34 +62,200 @@ class TokenList:
         :param irc: if True, set this token as IRC client
         :param timeOffset: the time offset from UTC for this user. Default: 0.
         :param tournament: if True, flag this client as a tournement client. Default: True.
+        :param userData: user data from user_helper.fetch_user_data.
+                                        Fetched here if not passed.
         :return: token object
         """
+        if userData is None:
+            userData = fetch_user_data(user_id=userID)
         newToken = UserToken(
-            userID,
+            userData,
             ip=ip,
             irc=irc,
             timeOffset=timeOffset,
             tournament=tournament,
         )
-        self.tokens[newToken.token] = newToken
+
+        # If we have a valid ip, save bancho session in DB so we can cache LETS logins
+        if ip != "":
+            glob.write_queue.save_session(newToken.userID, ip)
+
+        with self._lock:
+            self.tokens[newToken.token] = newToken
+            self._addToIndexes(newToken)
+            self._updatePresenceBundle(newToken.userID)
+
+        # Fokabot, IRC and tournament clients never time out
+        if newToken.userID != 999 and not newToken.irc and not newToken.tournament:
+            self.timeouts.schedule(
+                newToken.token,
+                newToken.pingTime + CLIENT_TIMEOUT,
+            )
         glob.redis.set("ripple:online_users", len(self.tokens))
+        if glob.debug:
+            self.checkIndexes()
         return newToken
 
-    def deleteToken(self, token: UserToken) -> None:
+    def deleteToken(self, token: str | UserToken) -> None:
         """
         Delete a token from token list if it exists
 
-        :param token: token string
+        :param token: token string or token object
         :return:
         """
-        if token in self.tokens:
-            if self.tokens[token].ip:
-                userUtils.deleteBanchoSessions(
-                    self.tokens[token].userID,
-                    self.tokens[token].ip,
-                )
-            t = self.tokens.pop(token)
-            glob.redis.set("ripple:online_users", len(glob.tokens.tokens))
+        if isinstance(token, UserToken):
+            token = token.token
+
+        with self._lock:
+            t = self.tokens.pop(token, None)
+            if t is None:
+                return
+            self._removeFromIndexes(t)
+            self._updatePresenceBundle(t.userID)
+            t.deleted = True
+        self.timeouts.cancel(token)
+
+        if t.ip:
+            glob.write_queue.delete_session(t.userID, t.ip)
+        glob.redis.set("ripple:online_users", len(self.tokens))
+        if glob.debug:
+            self.checkIndexes()
+
+    def _addToIndexes(self, token: UserToken) -> None:
+        """
+        Add a token to the userID and username indexes.
+        Must be called with the lock held.
+
+        :param token: token object
+        :return:
+        """
+        self._userIDIndex.setdefault(token.userID, []).append(token)
+        self._usernameIndex.setdefault(token.safeUsername, []).append(token)
+
+    def _removeFromIndexes(self, token: UserToken) -> None:
+        """
+        Remove a token from the userID and username indexes.
+        Must be called with the lock held.
+
+        :param token: token object
+        :return:
+        """
+        for index, key in (
+            (self._userIDIndex, token.userID),
+            (self._usernameIndex, token.safeUsername),
+        ):
+            tokens = index.get(key)
+            if tokens is None:
+                continue
+            if token in tokens:
+                tokens.remove(token)
+            if not tokens:
+                del index[key]
+
+    def _updatePresenceBundle(self, userID: int) -> None:
+        """
+        Add or remove an user from the presence bundle, depending on
+        whether they have any unrestricted token left.
+        Must be called with the lock held.
+
+        :param userID: user ID
+        :return:
+        """
+        visible = any(
+            not token.restricted for token in self._userIDIndex.get(userID, ())
+        )
+        if visible == (userID in self._presenceUserIDs):
+            return
+
+        if visible:
+            self._presenceUserIDs[userID] = None
+        else:
+            del self._presenceUserIDs[userID]
+        self._presenceBundle = None
+
+    def refreshPresenceBundle(self, userID: int) -> None:
+        """
+        Update an user's presence bundle entry after their
+        restricted status might have changed
+
+        :param userID: user ID
+        :return:
+        """
+        with self._lock:
+            self._updatePresenceBundle(userID)
+
+    def getPresenceBundle(self) -> bytes:
+        """
+        Get the presence bundle packet with the IDs of all
+        unrestricted online users. The packet is only encoded again
+        after someone logs in, logs out or gets (un)restricted.
+
+        :return: user presence bundle packet
+        """
+        bundle = self._presenceBundle
+        if bundle is None:
+            with self._lock:
+                if self._presenceBundle is None:
+                    self._presenceBundle = serverPackets.user_presence_bundle(
+                        self._presenceUserIDs,
+                    )
+                bundle = self._presenceBundle
+        return bundle
+
+    def updateUsername(
+        self,
+        token: UserToken,
+        username: str,
+        safeUsername: str,
+    ) -> None:
+        """
+        Change the username of a connected token and update the username index
+
+        :param token: token object
+        :param username: new username
+        :param safeUsername: new safe username
+        :return:
+        """
+        with self._lock:
+            self._removeFromIndexes(token)
+            token.username = username
+            token.safeUsername = safeUsername
+            token.resetPresencePacket()
+            if token.token in self.tokens:
+                self._addToIndexes(token)
+
+    def checkIndexes(self) -> bool:
+        """
+        Make sure the userID and username indexes and the presence bundle
+        match the tokens list. Only used in debug mode, as it walks every token.
+
+        :return: True if the indexes are consistent
+        """
+        with self._lock:
+            userIDIndex: dict[int, list[UserToken]] = {}
+            usernameIndex: dict[str, list[UserToken]] = {}
+            presenceUserIDs: dict[int, None] = {}
+            for value in self.tokens.values():
+                userIDIndex.setdefault(value.userID, []).append(value)
+                usernameIndex.setdefault(value.safeUsername, []).append(value)
+                if not value.restricted:
+                    presenceUserIDs[value.userID] = None
+
+            if (
+                userIDIndex == self._userIDIndex
+                and usernameIndex == self._usernameIndex
+                and presenceUserIDs.keys() == self._presenceUserIDs.keys()
+            ):
+                return True
+
+            log.error(
+                "Tokens indexes are out of sync with the tokens list! Rebuilding them.",
+            )
+            self._userIDIndex = userIDIndex
+            self._usernameIndex = usernameIndex
+            self._presenceUserIDs = presenceUserIDs
+            self._presenceBundle = None
+            return False
 
     def getUserIDFromToken(self, token: str) -> Optional[int]:
         """
@@ -90,10 +275,18 @@ class TokenList:
         :param userID: user ID to find
         :return: None if not found, token object if found
         """
-        userID = int(userID)
-        for value in self.tokens.values():
-            if value.userID == userID:
-                return value
+        tokens = self._userIDIndex.get(int(userID))
+        if tokens:
+            return tokens[0]
+
+    def getTokensFromUserID(self, userID: int) -> list[UserToken]:
+        """
+        Get all tokens of a user ID (more than one for tournament clients)
+
+        :param userID: user ID to find
+        :return: list of token objects, empty if not found
+        """
+        return list(self._userIDIndex.get(int(userID), ()))
 
     def getTokenFromUsername(
         self,
@@ -112,9 +305,9 @@ class TokenList:
         if not safe:
             username = username_safe(username)
 
-        for user in self.tokens.values():
-            if user.safeUsername == username:
-                return user
+        tokens = self._usernameIndex.get(username)
+        if tokens:
+            return tokens[0]
 
     def deleteOldTokens(self, userID: int) -> None:
         """
@@ -124,11 +317,10 @@ class TokenList:
         :return:
         """
         # Delete older tokens
-        for key, value in list(self.tokens.items()):
-            if value.userID == userID:
-                # Delete this token from the dictionary
-                # self.tokens[key].kick("You have logged in from somewhere else. You can't connect to Bancho/IRC from more than one device at the same time.", "kicked, multiple clients")
-                logoutEvent.handle(self.tokens[key])
+        for value in self.getTokensFromUserID(userID):
+            # Delete this token from the dictionary
+            # value.kick("You have logged in from somewhere else. You can't connect to Bancho/IRC from more than one device at the same time.", "kicked, multiple clients")
+            logoutEvent.handle(value)
 
     def multipleEnqueue(self, packet: bytes, who: list[int], but: bool = False) -> None:
         """
@@ -139,8 +331,15 @@ class TokenList:
         :param but: if True, enqueue to everyone but users in `who` array
         :return:
         """
+        if not but:
+            # Users may be listed more than once
+            for userID in dict.fromkeys(who):
+                for value in self._userIDIndex.get(userID, ()):
+                    value.enqueue(packet)
+            return
+
         for value in self.tokens.values():
-            if (value.userID in who and not but) or (value.userID not in who and but):
+            if value.userID not in who:
                 value.enqueue(packet)
 
     def enqueueAll(self, packet: bytes) -> None:
@@ -153,64 +352,63 @@ class TokenList:
         for value in self.tokens.values():
             value.enqueue(packet)
 
-    def usersTimeoutCheckLoop(self) -> None:
+    def usersTimeoutCheck(self) -> None:
         """
-        Start timed out users disconnect loop.
-        This function will be called every `checkTime` seconds and so on, forever.
-        CALL THIS FUNCTION ONLY ONCE!
+        Disconnect timed out users.
+        Only tokens whose timeout deadline passed are checked, the ones
+        that pinged since then get a new deadline.
+        Runs every 5 seconds, scheduled by glob.scheduler. The logouts
+        themselves write to redis and broadcast to the main stream, so they
+        run on glob.loginPool rather than stalling the IOLoop when a lot of
+        users time out at once.
+
         :return:
         """
-        try:
-            log.debug("Checking timed out clients")
-            exceptions = []
-            timeoutLimit = int(time.time()) - 100
-            for key, value in self.tokens.items():
-                # Check timeout (fokabot is ignored)
-                if (
-                    value.pingTime < timeoutLimit
-                    and value.userID != 999
-                    and not value.irc
-                    and not value.tournament
-                ):
-                    # That user has timed out, add to disconnected tokens
-                    # We can't delete it while iterating or items() throws an error
-                    log.debug(f"{value.username} timed out!!")
-                    value.enqueue(
-                        serverPackets.notification(
-                            "Your connection to the server timed out.",
-                        ),
-                    )
-                    try:
-                        logoutEvent.handle(value)
-                    except Exception as e:
-                        exceptions.append(e)
-                        log.error(
-                            "Something wrong happened while disconnecting a timed out client. Reporting to Sentry "
-                            "when the loop ends.",
-                        )
-
-            # Re-raise exceptions if needed
-            if exceptions:
-                raise periodicLoopException(exceptions)
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(100, self.usersTimeoutCheckLoop).start()
-
-    def spamProtectionResetLoop(self) -> None:
-        """
-        Start spam protection reset loop.
-        Called every 10 seconds.
-        CALL THIS FUNCTION ONLY ONCE!
+        timedOut = []
+        now = int(time.time())
+        for key in self.timeouts.pop_expired(now):
+            value = self.tokens.get(key)
+            if value is None:
+                continue
 
+            # Pinged since it was scheduled, check again later
+            deadline = value.pingTime + CLIENT_TIMEOUT
+            if deadline > now:
+                self.timeouts.schedule(key, deadline)
+                continue
+
+            timedOut.append(value)
+
+        if timedOut:
+            glob.loginPool.submit(self.logoutTimedOut, timedOut, now)
+
+    def logoutTimedOut(self, timedOut: list[UserToken], now: int) -> None:
+        """
+        Disconnect timed out users, found by `usersTimeoutCheck`.
+        Runs on glob.loginPool.
+
+        :param timedOut: tokens to disconnect
+        :param now: time of the timeout check
         :return:
         """
-        try:
-            # Reset spamRate for every token
-            for value in self.tokens.values():
-                value.spamRate = 0
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(10, self.spamProtectionResetLoop).start()
+        for value in timedOut:
+            # That user has timed out, disconnect them
+            log.debug(f"{value.username} timed out!!")
+            value.enqueue(
+                serverPackets.notification(
+                    "Your connection to the server timed out.",
+                ),
+            )
+            try:
+                logoutEvent.handle(value)
+            except Exception:
+                log.error(
+                    "Something wrong happened while disconnecting a timed out client!\n"
+                    + traceback.format_exc(),
+                )
+                # Try again later if it's still there
+                if value.token in self.tokens:
+                    self.timeouts.schedule(value.token, now + CLIENT_TIMEOUT)
 
     def deleteBanchoSessions(self) -> None:
         """
@@ -103,6 +103,12 @@ class Config(ConfigReader):
     REDIS_PASSWORD: str = ""
     GZIP_LEVEL: int     = 6
     THREADS_COUNT: int  = 2
+    LOGIN_THREADS_COUNT: int = 4
+    BCRYPT_THREADS_COUNT: int = 2
+    LOGIN_CONCURRENCY: int = 8
+    LOGIN_QUEUE_SIZE: int = 256
+    LOGIN_QUEUE_TIMEOUT: int = 10
+    RECONNECT_WINDOW: int = 30
     CI_KEY: str         = ""
     NEW_RANKED_WEBHOOK: str = ""
 
@@ -2,95 +2,100 @@ from __future__ import annotations
 
 from constants import dataTypes
 from constants import slotStatuses
-from helpers import packetHelper
+from helpers.packetHelper import PacketDecoder
 
+# Every packet structure is compiled once here, at import time.
+# The functions below only run the precompiled decoders.
 
 """ Users listing packets """
 
+_userActionChange = PacketDecoder(
+    [
+        ["actionID", dataTypes.BYTE],
+        ["actionText", dataTypes.STRING],
+        ["actionMd5", dataTypes.STRING],
+        ["actionMods", dataTypes.UINT32],
+        ["gameMode", dataTypes.BYTE],
+        ["beatmapID", dataTypes.SINT32],
+    ],
+)
+_usersList = PacketDecoder([["users", dataTypes.INT_LIST]])
+
 
 def userActionChange(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["actionID", dataTypes.BYTE],
-            ["actionText", dataTypes.STRING],
-            ["actionMd5", dataTypes.STRING],
-            ["actionMods", dataTypes.UINT32],
-            ["gameMode", dataTypes.BYTE],
-            ["beatmapID", dataTypes.SINT32],
-        ],
-    )
+    return _userActionChange.read(stream)
 
 
 def userStatsRequest(stream):
-    return packetHelper.readPacketData(stream, [["users", dataTypes.INT_LIST]])
+    return _usersList.read(stream)
 
 
 def userPanelRequest(stream):
-    return packetHelper.readPacketData(stream, [["users", dataTypes.INT_LIST]])
+    return _usersList.read(stream)
 
 
 """ Client chat packets """
 
+_sendPublicMessage = PacketDecoder(
+    [
+        ["unknown", dataTypes.STRING],
+        ["message", dataTypes.STRING],
+        ["to", dataTypes.STRING],
+    ],
+)
+_sendPrivateMessage = PacketDecoder(
+    [
+        ["unknown", dataTypes.STRING],
+        ["message", dataTypes.STRING],
+        ["to", dataTypes.STRING],
+        ["unknown2", dataTypes.UINT32],
+    ],
+)
+_setAwayMessage = PacketDecoder(
+    [["unknown", dataTypes.STRING], ["awayMessage", dataTypes.STRING]],
+)
+_channel = PacketDecoder([["channel", dataTypes.STRING]])
+_friendID = PacketDecoder([["friendID", dataTypes.SINT32]])
+
 
 def sendPublicMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["unknown", dataTypes.STRING],
-            ["message", dataTypes.STRING],
-            ["to", dataTypes.STRING],
-        ],
-    )
+    return _sendPublicMessage.read(stream)
 
 
 def sendPrivateMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["unknown", dataTypes.STRING],
-            ["message", dataTypes.STRING],
-            ["to", dataTypes.STRING],
-            ["unknown2", dataTypes.UINT32],
-        ],
-    )
+    return _sendPrivateMessage.read(stream)
 
 
 def setAwayMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [["unknown", dataTypes.STRING], ["awayMessage", dataTypes.STRING]],
-    )
+    return _setAwayMessage.read(stream)
 
 
 def channelJoin(stream):
-    return packetHelper.readPacketData(stream, [["channel", dataTypes.STRING]])
+    return _channel.read(stream)
 
 
 def channelPart(stream):
-    return packetHelper.readPacketData(stream, [["channel", dataTypes.STRING]])
+    return _channel.read(stream)
 
 
 def addRemoveFriend(stream):
-    return packetHelper.readPacketData(stream, [["friendID", dataTypes.SINT32]])
+    return _friendID.read(stream)
 
 
 """ Spectator packets """
 
+_spectateUserID = PacketDecoder([["userID", dataTypes.SINT32]])
+
 
 def startSpectating(stream):
-    return packetHelper.readPacketData(stream, [["userID", dataTypes.SINT32]])
+    return _spectateUserID.read(stream)
 
 
 """ Multiplayer packets """
 
-
-def matchSettings(stream):
-    # Data to return, will be merged later
-    data = []
-
-    # Some settings
-    struct = [
+# Some settings, slot statuses and slot teams (not used)
+_matchSettingsHead = PacketDecoder(
+    [
         ["matchID", dataTypes.UINT16],
         ["inProgress", dataTypes.BYTE],
         ["unknown", dataTypes.BYTE],
@@ -101,37 +106,39 @@ def matchSettings(stream):
         ["beatmapID", dataTypes.UINT32],
         ["beatmapMD5", dataTypes.STRING],
     ]
+    + [[f"slot{i}Status", dataTypes.BYTE] for i in range(0, 16)]
+    + [[f"slot{i}Team", dataTypes.BYTE] for i in range(0, 16)],
+)
+
+# User IDs, only sent for occupied slots
+_matchSettingsSlotUserID = [
+    PacketDecoder([[f"slot{i}UserId", dataTypes.SINT32]]) for i in range(0, 16)
+]
+
+# Other settings
+_matchSettingsTail = PacketDecoder(
+    [
+        ["hostUserID", dataTypes.SINT32],
+        ["gameMode", dataTypes.BYTE],
+        ["scoringType", dataTypes.BYTE],
+        ["teamType", dataTypes.BYTE],
+        ["freeMods", dataTypes.BYTE],
+    ],
+)
 
-    # Slot statuses (not used)
-    for i in range(0, 16):
-        struct.append([f"slot{str(i)}Status", dataTypes.BYTE])
-
-    # Slot statuses (not used)
-    for i in range(0, 16):
-        struct.append([f"slot{str(i)}Team", dataTypes.BYTE])
 
+def matchSettings(stream):
     # Read first part
-    slotData = packetHelper.readPacketData(stream, struct)
+    result = {}
+    pos = _matchSettingsHead.readInto(result, stream, 0)
 
     # Skip userIDs because fuck
     for i in range(0, 16):
-        s = slotData[f"slot{str(i)}Status"]
-        if s & (4 | 8 | 16 | 32 | 64) > 0:
-            struct.append([f"slot{str(i)}UserId", dataTypes.SINT32])
+        if result[f"slot{i}Status"] & (4 | 8 | 16 | 32 | 64) > 0:
+            pos = _matchSettingsSlotUserID[i].readInto(result, stream, pos)
 
     # Other settings
-    struct.extend(
-        [
-            ["hostUserID", dataTypes.SINT32],
-            ["gameMode", dataTypes.BYTE],
-            ["scoringType", dataTypes.BYTE],
-            ["teamType", dataTypes.BYTE],
-            ["freeMods", dataTypes.BYTE],
-        ],
-    )
-
-    # Results goes here
-    result = packetHelper.readPacketData(stream, struct)
+    _matchSettingsTail.readInto(result, stream, pos)
     return result
 
 
@@ -143,63 +150,69 @@ def changeMatchSettings(stream):
     return matchSettings(stream)
 
 
+_slotID = PacketDecoder([["slotID", dataTypes.UINT32]])
+_joinMatch = PacketDecoder(
+    [["matchID", dataTypes.UINT32], ["password", dataTypes.STRING]],
+)
+_mods = PacketDecoder([["mods", dataTypes.UINT32]])
+_inviteUserID = PacketDecoder([["userID", dataTypes.UINT32]])
+_matchFrames = PacketDecoder(
+    [
+        ["time", dataTypes.SINT32],
+        ["id", dataTypes.BYTE],
+        ["count300", dataTypes.UINT16],
+        ["count100", dataTypes.UINT16],
+        ["count50", dataTypes.UINT16],
+        ["countGeki", dataTypes.UINT16],
+        ["countKatu", dataTypes.UINT16],
+        ["countMiss", dataTypes.UINT16],
+        ["totalScore", dataTypes.SINT32],
+        ["maxCombo", dataTypes.UINT16],
+        ["currentCombo", dataTypes.UINT16],
+        ["perfect", dataTypes.BYTE],
+        ["currentHp", dataTypes.BYTE],
+        ["tagByte", dataTypes.BYTE],
+        ["usingScoreV2", dataTypes.BYTE],
+    ],
+)
+_matchID = PacketDecoder([["matchID", dataTypes.UINT32]])
+
+
 def changeSlot(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _slotID.read(stream)
 
 
 def joinMatch(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [["matchID", dataTypes.UINT32], ["password", dataTypes.STRING]],
-    )
+    return _joinMatch.read(stream)
 
 
 def changeMods(stream):
-    return packetHelper.readPacketData(stream, [["mods", dataTypes.UINT32]])
+    return _mods.read(stream)
 
 
 def lockSlot(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _slotID.read(stream)
 
 
 def transferHost(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _slotID.read(stream)
 
 
 def matchInvite(stream):
-    return packetHelper.readPacketData(stream, [["userID", dataTypes.UINT32]])
+    return _inviteUserID.read(stream)
 
 
 def match_frames(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["time", dataTypes.SINT32],
-            ["id", dataTypes.BYTE],
-            ["count300", dataTypes.UINT16],
-            ["count100", dataTypes.UINT16],
-            ["count50", dataTypes.UINT16],
-            ["countGeki", dataTypes.UINT16],
-            ["countKatu", dataTypes.UINT16],
-            ["countMiss", dataTypes.UINT16],
-            ["totalScore", dataTypes.SINT32],
-            ["maxCombo", dataTypes.UINT16],
-            ["currentCombo", dataTypes.UINT16],
-            ["perfect", dataTypes.BYTE],
-            ["currentHp", dataTypes.BYTE],
-            ["tagByte", dataTypes.BYTE],
-            ["usingScoreV2", dataTypes.BYTE],
-        ],
-    )
+    return _matchFrames.read(stream)
 
 
 def tournamentMatchInfoRequest(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _matchID.read(stream)
 
 
 def tournamentJoinMatchChannel(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _matchID.read(stream)
 
 
 def tournamentLeaveMatchChannel(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _matchID.read(stream)
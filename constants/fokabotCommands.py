@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-import json
 import pprint
 import random
 import re
 import sys
 import threading
 import time
+import traceback
 from collections import namedtuple
 from datetime import datetime
 from datetime import timedelta
@@ -14,7 +14,6 @@ from typing import Callable
 from typing import Optional
 
 import osupyparser
-import requests
 from common import generalUtils
 from common.constants import gameModes
 from common.constants import mods
@@ -42,11 +41,54 @@ from objects import fokabot
 from objects import glob
 
 REGEX = "^{}( (.+)?)?$"
+# Reply to a command that raised
+COMMAND_ERROR = (
+    "There was issue while processing your command, please report this to a developer."
+)
 commands = {}
 
 Command = namedtuple("Command", ["trigger", "callback", "syntax", "privileges"])
 
 
+class CommandTrie:
+    """Commands by the words of their trigger (eg `!system` -> `restart`), so
+    a message is routed by its first words rather than trying every regex."""
+
+    __slots__ = ("command", "children", "depth")
+
+    def __init__(self):
+        # (regex, command) of the trigger ending here, if any
+        self.command: Optional[tuple[re.Pattern, Command]] = None
+        self.children: dict[str, CommandTrie] = {}
+        # Words in the longest trigger below this node
+        self.depth = 0
+
+    def insert(self, trigger: str, regex: re.Pattern, command: Command) -> None:
+        words = trigger.split(" ")
+        self.depth = max(self.depth, len(words))
+        node = self
+        for word in words:
+            node = node.children.setdefault(word, CommandTrie())
+        node.command = (regex, command)
+
+    def find(self, message: str) -> Optional[tuple[re.Pattern, Command]]:
+        """Returns the (regex, command) of the longest trigger the message
+        starts with, None if there's none."""
+
+        node = self
+        found = None
+        for word in message.split(" ", self.depth):
+            node = node.children.get(word)
+            if node is None:
+                break
+            if node.command is not None:
+                found = node.command
+        return found
+
+
+commandTrie = CommandTrie()
+
+
 def registerCommand(
     trigger: str, syntax: Optional[str] = None, privs: Optional[int] = None,
 ):
@@ -55,12 +97,13 @@ def registerCommand(
 
     def wrapper(handler: Callable) -> Callable:
         rgx = re.compile(REGEX.format(trigger))
-        commands[rgx] = Command(
+        commands[rgx] = command = Command(
             trigger=trigger,
             callback=handler,
             syntax=syntax or "",
             privileges=privs or None,
         )
+        commandTrie.insert(trigger, rgx, command)
         return handler
 
     return wrapper
@@ -167,55 +210,62 @@ def getSpectatorHostUserIDFromChannel(chan):
     return user_id
 
 
-def getPPMessage(userID, just_data=False):
-    """Display PP stats for a map."""
-    try:
-        # Get user token
-        token = glob.tokens.getTokenFromUserID(userID)
-        if token is None:
-            return False
-
-        currentMap = token.tillerino[0]
-        currentMods = token.tillerino[1]
-        currentAcc = token.tillerino[2]
+def withPPData(token, replyTo, build):
+    """
+    Replies with `build(data)`, `data` being the pp api data of the token's
+    current tillerino map, mods and acc. The api is queried in the background
+    if the data isn't cached, and the reply sent to `replyTo` once it answers.
+
+    :param token: user token
+    :param replyTo: channel or username the reply is sent to
+    :param build: function building the reply from the api data
+    :return: the reply if the data was cached, otherwise False
+    """
+    key = (int(token.tillerino[0]), token.tillerino[1], token.tillerino[2])
+    data = glob.pp_client.get_cached(key)
+    if data is not None:
+        return build(data)
+
+    def reply(data, error):
+        if data is not None:
+            try:
+                error = build(data)
+            except Exception:
+                log.error(
+                    "There was an issue while building a pp reply.\n"
+                    + traceback.format_exc(),
+                )
+                error = COMMAND_ERROR
+        chat.sendMessage(glob.BOT_NAME, replyTo, error)
 
-        # Send request to LETS api
-        url = f"http://localhost:5002/api/v1/pp?b={currentMap}&m={currentMods}"
-        if currentAcc != -1:
-            url += f"&a{currentAcc}"
-        resp = requests.get(url, timeout=10)
-        assert resp is not None
-        data = json.loads(resp.text)
+    glob.pp_client.fetch(key, reply)
+    return False
 
-        # Make sure status is in response data
-        if "status" not in data:
-            raise exceptions.apiException("No data from API!")
 
-        # Make sure status is 200
-        if data["status"] != 200:
-            if "message" in data:
-                return f"There has been an exception the in PP API ({data['message']})."
+def getPPMessage(userID, replyTo):
+    """Display PP stats for a map."""
+    # Get user token
+    token = glob.tokens.getTokenFromUserID(userID)
+    if token is None:
+        return False
 
-        if just_data:
-            return data
+    currentMods = token.tillerino[1]
+    currentAcc = token.tillerino[2]
 
+    def build(data):
         # Format result.
         # Kisumi style :sunglasses:
         if currentAcc == -1:
-            msg = (
+            return (
                 f"{data['song_name']} {'+' + generalUtils.readableMods(currentMods) if currentMods else ''}\n"
                 f"| 100% = {data['pp'][0]:.2f}pp | | 99% = {data['pp'][1]:.2f}pp | | 98% = {data['pp'][2]:.2f}pp | | 95% = {data['pp'][3]:.2f}pp | "
             )
-        else:
-            msg = (
-                f"{data['song_name']} {'+' + generalUtils.readableMods(currentMods) if currentMods else ''}\n"
-                f"| {token.tillerino[2]:.2f}% = {data['pp'][0]:.2f}pp |"
-            )
+        return (
+            f"{data['song_name']} {'+' + generalUtils.readableMods(currentMods) if currentMods else ''}\n"
+            f"| {currentAcc:.2f}% = {data['pp'][0]:.2f}pp |"
+        )
 
-        return msg
-    except requests.exceptions.RequestException:
-        # RequestException
-        return "Score server API timeout. Please try again in a few seconds."
+    return withPPData(token, replyTo, build)
 
 
 """
@@ -835,7 +885,7 @@ def tillerinoNp(fro, chan, message):
     userID = token.userID
 
     # Return tillerino message
-    return getPPMessage(userID)
+    return getPPMessage(userID, fro)
 
 
 @registerCommand(trigger="!with", syntax="<mods>")
@@ -898,7 +948,7 @@ def tillerinoMods(fro, chan, message):
     token.tillerino[1] = modsEnum
 
     # Return tillerino message for that beatmap with mods
-    return getPPMessage(userID)
+    return getPPMessage(userID, fro)
 
 
 @registerCommand(trigger="!acc", syntax="<accuracy>")
@@ -926,7 +976,7 @@ def tillerinoAcc(fro, chan, message):
         token.tillerino[2] = acc
 
         # Return tillerino message for that beatmap with mods
-        return getPPMessage(userID)
+        return getPPMessage(userID, fro)
     except ValueError:
         return "Invalid acc value"
 
@@ -983,7 +1033,6 @@ def tillerinoLast(fro, chan, message):
     token.tillerino[0] = data["bid"]
     token.tillerino[1] = data["mods"]
     token.tillerino[2] = fc_acc
-    oppaiData = getPPMessage(token.userID, just_data=True)
 
     user_embed = f"[https://ussr.pl/u/{token.userID} {fro}]"
     map_embed = f"[http://ussr.pl/beatmaps/{data['bid']} {data['sn']}]"
@@ -1011,23 +1060,28 @@ def tillerinoLast(fro, chan, message):
         data["misses_count"],
     )
 
-    completion_or_pp = (
-        (
-            f" | {completion:.2f}% map completed"
-            if rank == "F" and data["play_mode"] == 0
-            else ""
-        )
-        if score_fced
-        else f" | ({oppaiData['pp'][-1]:.2f} for {fc_acc:.2f}% FC)"
-    )
     accuracy_expanded = f"{data['100_count']}x100 // {data['50_count']}x50 // {data['misses_count']}xMiss"
 
-    response.append(
-        f"{{{rank.upper()}, {data['accuracy']:.2f}%}}{fc_or_failquit} {data['max_combo']}/{data['fc']}x | {data['pp']:.2f}pp | {oppaiData['stars']:.2f} ★{completion_or_pp}",
-    )
-    response.append(f"{{ {accuracy_expanded} }}")
+    def build(oppaiData):
+        completion_or_pp = (
+            (
+                f" | {completion:.2f}% map completed"
+                if rank == "F" and data["play_mode"] == 0
+                else ""
+            )
+            if score_fced
+            else f" | ({oppaiData['pp'][-1]:.2f} for {fc_acc:.2f}% FC)"
+        )
 
-    return "\n".join(response)
+        return "\n".join(
+            (
+                *response,
+                f"{{{rank.upper()}, {data['accuracy']:.2f}%}}{fc_or_failquit} {data['max_combo']}/{data['fc']}x | {data['pp']:.2f}pp | {oppaiData['stars']:.2f} ★{completion_or_pp}",
+                f"{{ {accuracy_expanded} }}",
+            ),
+        )
+
+    return withPPData(token, chan if chan.startswith("#") else fro, build)
 
 
 reportRegex = re.compile(r"^(.+) \((.+)\)\:(?: )?(.+)?$")
@@ -1752,7 +1806,7 @@ def bless(fro: str, chan: str, message: str) -> str:
     # Use bytearray for speed
     q = bytearray()
     for b in bible_split:
-        q += serverPackets.message_notify("Jesus", t_user.username, b)
+        q += serverPackets.message_notify("Jesus", t_user.username, b, 0)
     t_user.enqueue(q)
     return "THEY ARE BLESSED AND ASCENDED TO HeAVeN"
 
@@ -1795,8 +1849,9 @@ def troll(fro: str, chan: str, message: str) -> str:
         "Trollface",
         t_user.username,
         "We do little bit of trolling :tf:",
+        0,
     )
-    q += serverPackets.message_notify("Trollface", t_user.username, ASCII_TROLL)
+    q += serverPackets.message_notify("Trollface", t_user.username, ASCII_TROLL, 0)
     t_user.enqueue(q)
     return "They have been trolled"
 
@@ -2,9 +2,7 @@
 from __future__ import annotations
 
 from common.constants import privileges
-from common.ripple import userUtils
 
-from constants import dataTypes
 from constants import packetIDs
 from constants import userRanks
 from constants.rosuprivs import BAT
@@ -12,7 +10,7 @@ from constants.rosuprivs import DEV_SUPPORTER
 from constants.rosuprivs import DEVELOPER
 from constants.rosuprivs import MODERATOR
 from constants.rosuprivs import OWNER
-from helpers import packetHelper
+from helpers.packetHelper import PacketWriter
 from objects import glob
 
 """ Login errors packets """
@@ -48,14 +46,15 @@ def verification_required():
 
 
 def login_reply(uid):
-    return packetHelper.buildPacket(packetIDs.server_userID, ((uid, dataTypes.SINT32),))
+    packet = PacketWriter(packetIDs.server_userID)
+    packet.writeSInt32(uid)
+    return packet.finish()
 
 
 def silence_end_notify(seconds):
-    return packetHelper.buildPacket(
-        packetIDs.server_silenceEnd,
-        ((seconds, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_silenceEnd)
+    packet.writeUInt32(seconds)
+    return packet.finish()
 
 
 def protocol_version(version=19):
@@ -65,10 +64,9 @@ def protocol_version(version=19):
 
 
 def menu_icon(icon):
-    return packetHelper.buildPacket(
-        packetIDs.server_mainMenuIcon,
-        ((icon, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_mainMenuIcon)
+    packet.writeString(icon)
+    return packet.finish()
 
 
 def bancho_priv(supporter, GMT, tournamentStaff):
@@ -79,31 +77,25 @@ def bancho_priv(supporter, GMT, tournamentStaff):
         result |= userRanks.BAT
     if tournamentStaff:
         result |= userRanks.TOURNAMENT_STAFF
-    return packetHelper.buildPacket(
-        packetIDs.server_supporterGMT,
-        ((result, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_supporterGMT)
+    packet.writeUInt32(result)
+    return packet.finish()
 
 
-def friend_list(userID):
-    friends = userUtils.getFriendList(userID)
-    return packetHelper.buildPacket(
-        packetIDs.server_friendsList,
-        ((friends, dataTypes.INT_LIST),),
-    )
+def friend_list(friends):
+    packet = PacketWriter(packetIDs.server_friendsList)
+    packet.writeIntList(friends)
+    return packet.finish()
 
 
 """ Users packets """
 
 
 def logout_notify(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_userLogout,
-        (
-            (userID, dataTypes.SINT32),
-            (0, dataTypes.BYTE),
-        ),
-    )
+    packet = PacketWriter(packetIDs.server_userLogout, 5)
+    packet.writeSInt32(userID)
+    packet.writeByte(0)
+    return packet.finish()
 
 
 def user_presence(userID, force=False):
@@ -112,6 +104,11 @@ def user_presence(userID, force=False):
     if userToken is None:
         return b""
 
+    # Encoded once and cached on the token until one of its fields changes
+    return userToken.getPresencePacket()
+
+
+def build_user_presence(userToken):
     # Get user data
     username = userToken.username
     timezone = 24 + userToken.timeOffset
@@ -136,19 +133,22 @@ def user_presence(userID, force=False):
     else:
         userRank |= userRanks.NORMAL
 
-    return packetHelper.buildPacket(
-        packetIDs.server_userPanel,
-        (
-            (userID, dataTypes.SINT32),
-            (username, dataTypes.STRING),
-            (timezone, dataTypes.BYTE),
-            (country, dataTypes.BYTE),
-            (userRank, dataTypes.BYTE),
-            (longitude, dataTypes.FFLOAT),
-            (latitude, dataTypes.FFLOAT),
-            (gameRank, dataTypes.UINT32),
-        ),
-    )
+    packet = PacketWriter(packetIDs.server_userPanel)
+    packet.writeSInt32(userToken.userID)
+    packet.writeString(username)
+    packet.writeByte(timezone)
+    packet.writeByte(country)
+    packet.writeByte(userRank)
+    packet.writeFloat(longitude)
+    packet.writeFloat(latitude)
+    packet.writeUInt32(gameRank)
+    return packet.finish()
+
+
+def user_presence_bundle(userIDs):
+    packet = PacketWriter(packetIDs.server_userPresenceBundle, 2 + 4 * len(userIDs))
+    packet.writeIntList(userIDs)
+    return packet.finish()
 
 
 def user_stats(userID):
@@ -157,60 +157,55 @@ def user_stats(userID):
     if userToken is None:
         return b""
 
-    return packetHelper.buildPacket(
-        packetIDs.server_userStats,
-        (
-            (userID, dataTypes.UINT32),
-            (userToken.actionID, dataTypes.BYTE),
-            (userToken.actionText, dataTypes.STRING),
-            (userToken.actionMd5, dataTypes.STRING),
-            (userToken.actionMods, dataTypes.SINT32),
-            (userToken.gameMode, dataTypes.BYTE),
-            (userToken.beatmapID, dataTypes.SINT32),
-            (userToken.rankedScore, dataTypes.UINT64),
-            (userToken.accuracy, dataTypes.FFLOAT),
-            (userToken.playcount, dataTypes.UINT32),
-            (userToken.totalScore, dataTypes.UINT64),
-            (userToken.gameRank, dataTypes.UINT32),
-            (userToken.pp if 65535 >= userToken.pp > 0 else 0, dataTypes.UINT16),
-        ),
-    )
+    # Encoded once and cached on the token until one of its fields changes
+    return userToken.getStatsPacket()
+
+
+def build_user_stats(userToken):
+    packet = PacketWriter(packetIDs.server_userStats, 128)
+    packet.writeUInt32(userToken.userID)
+    packet.writeByte(userToken.actionID)
+    packet.writeString(userToken.actionText)
+    packet.writeString(userToken.actionMd5)
+    packet.writeSInt32(userToken.actionMods)
+    packet.writeByte(userToken.gameMode)
+    packet.writeSInt32(userToken.beatmapID)
+    packet.writeUInt64(userToken.rankedScore)
+    packet.writeFloat(userToken.accuracy)
+    packet.writeUInt32(userToken.playcount)
+    packet.writeUInt64(userToken.totalScore)
+    packet.writeUInt32(userToken.gameRank)
+    packet.writeUInt16(userToken.pp if 65535 >= userToken.pp > 0 else 0)
+    return packet.finish()
 
 
 """ Chat packets """
 
 
-def message_notify(fro: str, to: str, message: str):
-    return packetHelper.buildPacket(
-        packetIDs.server_sendMessage,
-        (
-            (fro, dataTypes.STRING),
-            (message, dataTypes.STRING),
-            (to, dataTypes.STRING),
-            (userUtils.getID(fro), dataTypes.SINT32),
-        ),
-    )
+def message_notify(fro: str, to: str, message: str, fro_id: int):
+    packet = PacketWriter(packetIDs.server_sendMessage, len(message) + 64)
+    packet.writeString(fro)
+    packet.writeString(message)
+    packet.writeString(to)
+    packet.writeSInt32(fro_id)
+    return packet.finish()
 
 
 def channel_join_success(chan: str):
-    return packetHelper.buildPacket(
-        packetIDs.server_channel_join_success,
-        ((chan, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_channel_join_success)
+    packet.writeString(chan)
+    return packet.finish()
 
 
 def channel_info(chan: str):
     if chan not in glob.channels.channels:
         return b""
     channel = glob.channels.channels[chan]
-    return packetHelper.buildPacket(
-        packetIDs.server_channelInfo,
-        (
-            (channel.name, dataTypes.STRING),
-            (channel.description, dataTypes.STRING),
-            (len(glob.streams.streams[f"chat/{chan}"].clients), dataTypes.UINT16),
-        ),
-    )
+    packet = PacketWriter(packetIDs.server_channelInfo)
+    packet.writeString(channel.name)
+    packet.writeString(channel.description)
+    packet.writeUInt16(len(glob.streams.streams[f"chat/{chan}"].clients))
+    return packet.finish()
 
 
 def channel_info_end():
@@ -218,62 +213,54 @@ def channel_info_end():
 
 
 def channel_kicked(chan):
-    return packetHelper.buildPacket(
-        packetIDs.server_channelKicked,
-        ((chan, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_channelKicked)
+    packet.writeString(chan)
+    return packet.finish()
 
 
 def silenced_notify(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_userSilenced,
-        ((userID, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_userSilenced)
+    packet.writeUInt32(userID)
+    return packet.finish()
 
 
 """ Spectator packets """
 
 
 def spectator_add(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorJoined,
-        ((userID, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_spectatorJoined)
+    packet.writeSInt32(userID)
+    return packet.finish()
 
 
 def spectator_remove(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorLeft,
-        ((userID, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_spectatorLeft)
+    packet.writeSInt32(userID)
+    return packet.finish()
 
 
 def spectator_frames(data):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectateFrames,
-        ((data, dataTypes.BBYTES),),
-    )
+    packet = PacketWriter(packetIDs.server_spectateFrames, len(data))
+    packet.writeBytes(data)
+    return packet.finish()
 
 
 def spectator_song_missing(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorCantSpectate,
-        ((userID, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_spectatorCantSpectate)
+    packet.writeSInt32(userID)
+    return packet.finish()
 
 
 def spectator_comrade_joined(user_id: int) -> bytes:
-    return packetHelper.buildPacket(
-        packetIDs.server_fellowSpectatorJoined,
-        ((user_id, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_fellowSpectatorJoined)
+    packet.writeSInt32(user_id)
+    return packet.finish()
 
 
 def spectator_comrade_left(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_fellowSpectatorLeft,
-        ((userID, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_fellowSpectatorLeft)
+    packet.writeSInt32(userID)
+    return packet.finish()
 
 
 """ Multiplayer Packets """
@@ -286,8 +273,9 @@ def match_create(matchID):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    matchData = match.getMatchData(censored=True)
-    return packetHelper.buildPacket(packetIDs.server_newMatch, matchData)
+    packet = PacketWriter(packetIDs.server_newMatch, 256)
+    match.writeMatchData(packet, censored=True)
+    return packet.finish()
 
 
 # TODO: Add match object argument to save some CPU
@@ -298,10 +286,9 @@ def match_update(matchID, censored=False):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    return packetHelper.buildPacket(
-        packetIDs.server_updateMatch,
-        match.getMatchData(censored=censored),
-    )
+    packet = PacketWriter(packetIDs.server_updateMatch, 256)
+    match.writeMatchData(packet, censored=censored)
+    return packet.finish()
 
 
 def match_start(matchID: int):
@@ -311,14 +298,15 @@ def match_start(matchID: int):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    return packetHelper.buildPacket(packetIDs.server_matchStart, match.getMatchData())
+    packet = PacketWriter(packetIDs.server_matchStart, 256)
+    match.writeMatchData(packet)
+    return packet.finish()
 
 
 def match_dispose(matchID):
-    return packetHelper.buildPacket(
-        packetIDs.server_disposeMatch,
-        ((matchID, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_disposeMatch)
+    packet.writeUInt32(matchID)
+    return packet.finish()
 
 
 def match_join_success(matchID):
@@ -328,11 +316,9 @@ def match_join_success(matchID):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    data = packetHelper.buildPacket(
-        packetIDs.server_matchJoinSuccess,
-        match.getMatchData(),
-    )
-    return data
+    packet = PacketWriter(packetIDs.server_matchJoinSuccess, 256)
+    match.writeMatchData(packet)
+    return packet.finish()
 
 
 def match_join_fail():
@@ -340,10 +326,9 @@ def match_join_fail():
 
 
 def match_change_password(newPassword):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchChangePassword,
-        ((newPassword, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_matchChangePassword)
+    packet.writeString(newPassword)
+    return packet.finish()
 
 
 def match_all_players_loaded():
@@ -351,10 +336,9 @@ def match_all_players_loaded():
 
 
 def match_player_skipped(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchPlayerSkipped,
-        ((userID, dataTypes.SINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_matchPlayerSkipped)
+    packet.writeSInt32(userID)
+    return packet.finish()
 
 
 def match_all_skipped():
@@ -362,14 +346,12 @@ def match_all_skipped():
 
 
 def match_frames(slotID, data):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchScoreUpdate,
-        (
-            (data[7:11], dataTypes.BBYTES),
-            (slotID, dataTypes.BYTE),
-            (data[12:], dataTypes.BBYTES),
-        ),
-    )
+    # `data` is the client's score frame packet data, we only replace its slot ID
+    packet = PacketWriter(packetIDs.server_matchScoreUpdate, len(data))
+    packet.writeBytes(data[0:4])
+    packet.writeByte(slotID)
+    packet.writeBytes(data[5:])
+    return packet.finish()
 
 
 def match_complete():
@@ -377,10 +359,9 @@ def match_complete():
 
 
 def match_player_fail(slotID):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchPlayerFailed,
-        ((slotID, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_matchPlayerFailed)
+    packet.writeUInt32(slotID)
+    return packet.finish()
 
 
 def match_new_host_notify():
@@ -395,28 +376,27 @@ def match_abort():
 
 
 def server_switch(address):
-    return packetHelper.buildPacket(
-        packetIDs.server_switchServer,
-        ((address, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_switchServer)
+    packet.writeString(address)
+    return packet.finish()
 
 
 def notification(message):
-    return packetHelper.buildPacket(
-        packetIDs.server_notification,
-        ((message, dataTypes.STRING),),
-    )
+    packet = PacketWriter(packetIDs.server_notification)
+    packet.writeString(message)
+    return packet.finish()
 
 
 def server_restart(msUntilReconnection):
-    return packetHelper.buildPacket(
-        packetIDs.server_restart,
-        ((msUntilReconnection, dataTypes.UINT32),),
-    )
+    packet = PacketWriter(packetIDs.server_restart)
+    packet.writeUInt32(msUntilReconnection)
+    return packet.finish()
 
 
 def rtx(message):
-    return packetHelper.buildPacket(0x69, ((message, dataTypes.STRING),))
+    packet = PacketWriter(0x69)
+    packet.writeString(message)
+    return packet.finish()
 
 
 def crash():
@@ -76,9 +76,10 @@ if userToken.matchID != -1 and userToken.actionID != actions.MULTIPLAYING and us
             userToken.actionText = f"[{prefix}]"
     else:
         userToken.actionText = f"[{prefix}] " + packetData["actionText"]
+    userToken.resetStatsPacket()
 
     # Enqueue our new user panel and stats to us and our spectators
-    p = serverPackets.user_presence(userID) + serverPackets.user_stats(userID)
+    p = userToken.getPresencePacket() + userToken.getStatsPacket()
     userToken.enqueue(p)
     if userToken.spectators:
         for i in userToken.spectators:
@@ -5,7 +5,10 @@ import sys
 import time
 import traceback
 from datetime import datetime
+from typing import Optional
+from typing import TYPE_CHECKING
 
+import tornado.gen
 from common.constants import privileges
 from common.ripple import userUtils
 
@@ -14,19 +17,165 @@ from constants import serverPackets
 from helpers import chatHelper as chat
 from helpers import geo_helper
 from helpers.geo_helper import get_full
-from helpers.realistik_stuff import Timer
-from helpers.user_helper import get_country
+from helpers.latency_helper import PhaseTimer
+from helpers.user_helper import fetch_user_data
 from helpers.user_helper import insert_ban_log
 from helpers.user_helper import restrict_with_log
-from helpers.user_helper import set_country
 from helpers.user_helper import verify_password
 from logger import log
 from objects import glob
 
+if TYPE_CHECKING:
+    from objects.osuToken import UserToken
+
+# Blocking login steps. They run on glob.loginPool so the IOLoop
+# keeps serving other clients while bcrypt and the DB do their thing.
+
+
+def fetch_user(
+    safe_username: str,
+    password: str,
+    timer: PhaseTimer,
+) -> tuple[Optional[dict], bool]:
+    """Fetches all of the user's data needed for login (see `fetch_user_data`)
+    and checks their password.
+
+    Returns:
+        Tuple of the user's data (or `None` if they don't exist) and whether
+        the password is correct.
+    """
+
+    # Set stuff from as few queries as possible rather than many userUtils calls.
+    user_db = fetch_user_data(safe_username=safe_username)
+    timer.phase("db")
+    if not user_db:
+        return None, False
+
+    passwordValid = verify_password(
+        user_db["id"],
+        password,
+        user_db["password_md5"],
+    )
+    timer.phase("password")
+    return user_db, passwordValid
+
+
+def log_client(
+    userID: int,
+    priv: int,
+    clientData: list[str],
+    requestIP: str,
+    osuVersion: str,
+) -> None:
+    """Verifies the user's hardware (if pending activation), then logs their
+    hardware, IP and osu! version.
+
+    Raises:
+        `loginBannedException` if a multiaccount is detected.
+        `haxException` if the client sent no hardware data.
+    """
+
+    # Verify this user (if pending activation)
+    firstLogin = False
+    if (
+        priv & privileges.USER_PENDING_VERIFICATION
+        or not userUtils.hasVerifiedHardware(userID)
+    ):
+        if userUtils.verifyUser(userID, clientData):
+            # Valid account
+            log.info(f"Account {userID} verified successfully!")
+            glob.verifiedCache[str(userID)] = 1
+            firstLogin = True
+        else:
+            # Multiaccount detected
+            log.info(f"Account {userID} NOT verified!")
+            glob.verifiedCache[str(userID)] = 0
+            raise exceptions.loginBannedException()
+
+    # Save HWID in db for multiaccount detection
+    hwAllowed = userUtils.logHardware(
+        userID,
+        clientData,
+        firstLogin,
+    )  # THIS IS SO SLOW
+
+    # This is false only if HWID is empty
+    # if HWID is banned, we get restricted so there's no
+    # need to deny bancho access
+    if not hwAllowed:
+        raise exceptions.haxException()
+
+    # Log user IP and osuver, they're written in the background
+    glob.write_queue.log_ip(userID, requestIP)
+    glob.write_queue.set_osu_version(userID, osuVersion)
+
+
+def localise(
+    userID: int,
+    userCountry: str,
+    requestIP: str,
+) -> tuple[float, float, str]:
+    """Gets the user's location and country from their IP, saving the country
+    in the db if they have none yet (first bancho login).
+
+    Returns:
+        Tuple of latitude, longitude and country letters.
+    """
+
+    latitude, longitude, countryLetters = get_full(requestIP)
+
+    if userCountry == "XX":
+        glob.write_queue.set_country(userID, countryLetters)
+
+    return latitude, longitude, countryLetters
+
+
+def create_token(
+    user_db: dict,
+    requestIP: str,
+    timeOffset: int,
+    isTournament: bool,
+    restricted: bool,
+) -> UserToken:
+    """Replaces the user's old tokens (unless it's a tournament client) with
+    a new one, telling them if they are restricted.
+
+    Returns:
+        The new token.
+    """
+
+    userID = user_db["id"]
+    if not isTournament:
+        glob.tokens.deleteOldTokens(userID)
+    token = glob.tokens.addToken(
+        userID,
+        requestIP,
+        timeOffset=timeOffset,
+        tournament=isTournament,
+        userData=user_db,
+    )
+
+    if restricted:
+        token.notify_restricted()
+    return token
+
+
+def join_channels(token: UserToken) -> None:
+    """Joins the default channels, and #admin for admins."""
+
+    # TODO: Configurable default channels
+    chat.joinChannel(token=token, channel="#osu")
+    chat.joinChannel(token=token, channel="#announce")
+
+    # Join admin channel if we are an admin
+    if token.admin:
+        chat.joinChannel(token=token, channel="#admin")
+
+
+@tornado.gen.coroutine
 def handle(tornadoRequest):
-    # I wanna benchmark!
-    t = Timer()
-    t.start()
+    # Time every login phase, see glob.login_phases
+    timer = glob.login_phases.timer()
     # Data to return
     responseToken = None
     responseTokenString = ""
@@ -62,11 +211,11 @@ def handle(tornadoRequest):
         username = str(loginData[0])
         safe_username = username.rstrip().replace(" ", "_").lower()
 
-        # Set stuff from single query rather than many userUtils calls.
-        user_db = glob.db.fetch(
-            "SELECT id, privileges, silence_end, donor_expire, frozen FROM users "
-            "WHERE username_safe = %s LIMIT 1",
-            (safe_username,),
+        user_db, passwordValid = yield glob.loginPool.submit(
+            fetch_user,
+            safe_username,
+            loginData[1],
+            timer,
         )
 
         if not user_db:
@@ -82,7 +231,7 @@ def handle(tornadoRequest):
         silence_end = int(user_db["silence_end"])
         donor_expire = int(user_db["donor_expire"])
 
-        if not verify_password(userID, loginData[1]):
+        if not passwordValid:
             # Invalid password
             log.error(f"Login failed for user {username} (invalid password)!")
             responseData += serverPackets.notification(
@@ -98,70 +247,35 @@ def handle(tornadoRequest):
             )
             raise exceptions.loginBannedException()
 
-        # No login errors!
-        log.info(f"DB stuff and password verification done at {t.end_time_str()}")
-
-        # Verify this user (if pending activation)
-        firstLogin = False
-        if (
-            priv & privileges.USER_PENDING_VERIFICATION
-            or not userUtils.hasVerifiedHardware(userID)
-        ):
-            if userUtils.verifyUser(userID, clientData):
-                # Valid account
-                log.info(f"Account {userID} verified successfully!")
-                glob.verifiedCache[str(userID)] = 1
-                firstLogin = True
-            else:
-                # Multiaccount detected
-                log.info(f"Account {userID} NOT verified!")
-                glob.verifiedCache[str(userID)] = 0
-                raise exceptions.loginBannedException()
-
-        # Save HWID in db for multiaccount detection
-        hwAllowed = userUtils.logHardware(
+        # Verify, log hardware, IP and osu! version
+        yield glob.loginPool.submit(
+            log_client,
             userID,
+            priv,
             clientData,
-            firstLogin,
-        )  # THIS IS SO SLOW
-
-        # This is false only if HWID is empty
-        # if HWID is banned, we get restricted so there's no
-        # need to deny bancho access
-        if not hwAllowed:
-            raise exceptions.haxException()
-
-        # Log user IP
-        userUtils.logIP(userID, requestIP)
-
-        # Log user osuver
-        glob.db.execute(
-            "UPDATE users SET osuver = %s WHERE id = %s LIMIT 1",
-            [osuVersion, userID],
-        )
-        log.info(f"Finished hardware and logging IP at {t.end_time_str()}")
-
-        # Delete old tokens for that user and generate a new one
-        isTournament = "tourney" in osuVersion
-        if not isTournament:
-            glob.tokens.deleteOldTokens(userID)
-        responseToken = glob.tokens.addToken(
-            userID,
             requestIP,
-            timeOffset=timeOffset,
-            tournament=isTournament,
+            osuVersion,
         )
-        responseTokenString = responseToken.token
+        timer.phase("hardware")
 
-        # Check restricted mode (and eventually send message)
+        # Check restricted mode
         # Cache this for less db queries
         user_restricted = (priv & privileges.USER_NORMAL) and not (
             priv & privileges.USER_PUBLIC
         )
 
-        if user_restricted:
-            responseToken.notify_restricted()
-        # responseToken.checkRestricted()
+        # Delete old tokens for that user and generate a new one
+        # (eventually sending the restricted message)
+        responseToken = yield glob.loginPool.submit(
+            create_token,
+            user_db,
+            requestIP,
+            timeOffset,
+            "tourney" in osuVersion,
+            user_restricted,
+        )
+        responseTokenString = responseToken.token
+        timer.phase("token")
 
         # Send message if donor expires soon
         if responseToken.privileges & privileges.USER_DONOR:
@@ -198,7 +312,10 @@ def handle(tornadoRequest):
         if glob.banchoConf.config["banchoMaintenance"]:
             if not userGMT:
                 # We are not mod/admin, delete token, send notification and logout
-                glob.tokens.deleteToken(responseTokenString)
+                yield glob.loginPool.submit(
+                    glob.tokens.deleteToken,
+                    responseTokenString,
+                )
                 raise exceptions.banchoMaintenanceException()
             else:
                 # We are mod/admin, send warning notification and continue
@@ -208,33 +325,23 @@ def handle(tornadoRequest):
                     ),
                 )
 
-        log.info(f"Donor, silence and maintenence checks at {t.end_time_str()}")
-
         # Send all needed login packets
         responseToken.enqueue(
             bytearray(serverPackets.silence_end_notify(silenceSeconds))
             + serverPackets.login_reply(userID)  # Fast addition
             + serverPackets.protocol_version()
             + serverPackets.bancho_priv(userSupporter, userGMT, userTournament)
-            + serverPackets.user_presence(userID, True)
-            + serverPackets.user_stats(userID)
+            + responseToken.getPresencePacket()
+            + responseToken.getStatsPacket()
             + serverPackets.channel_info_end()
-            + serverPackets.friend_list(userID),
+            + serverPackets.friend_list(user_db["friends"]),
         )
 
         # Default opened channels
-        # TODO: Configurable default channels
-        chat.joinChannel(token=responseToken, channel="#osu")
-        chat.joinChannel(token=responseToken, channel="#announce")
-
-        # Join admin channel if we are an admin
-        if responseToken.admin:
-            chat.joinChannel(token=responseToken, channel="#admin")
+        yield glob.loginPool.submit(join_channels, responseToken)
 
         # Output channels info
-        for key, value in glob.channels.channels.items():
-            if value.publicRead and not value.hidden:
-                responseToken.enqueue(serverPackets.channel_info(key))
+        responseToken.enqueue(glob.channels.getInfoBundle())
 
         # Send main menu icon
         if glob.banchoConf.config["menuIcon"] != "":
@@ -242,34 +349,35 @@ def handle(tornadoRequest):
                 serverPackets.menu_icon(glob.banchoConf.config["menuIcon"]),
             )
 
-        # Send online users' panels
-        with glob.tokens:
-            for token in glob.tokens.tokens.values():
-                if not token.restricted:
-                    responseToken.enqueue(serverPackets.user_presence(token.userID))
+        # Send online users' IDs, the client requests their panels when it needs them
+        responseToken.enqueue(glob.tokens.getPresenceBundle())
 
-        log.info(f"Server state and chat {t.end_time_str()}")
+        timer.phase("packets")
 
         # Localise the user based off IP.
         # Get location and country from IP
-        latitude, longitude, countryLetters = get_full(requestIP)
+        latitude, longitude, countryLetters = yield glob.loginPool.submit(
+            localise,
+            userID,
+            user_db["country"],
+            requestIP,
+        )
 
         country = geo_helper.getCountryID(countryLetters)
+        timer.phase("geo")
 
         # Set location and country
         responseToken.setLocation(latitude, longitude)
         responseToken.country = country
-
-        # Set country in db if user has no country (first bancho login)
-        if get_country(userID) == "XX":
-            set_country(userID, countryLetters)
+        responseToken.resetPresencePacket()
 
         # Send to everyone our userpanel if we are not restricted or tournament
         if not responseToken.restricted:
-            glob.streams.broadcast("main", serverPackets.user_presence(userID))
+            glob.streams.broadcast("main", responseToken.getPresencePacket())
+        timer.phase("broadcast")
 
         # creating notification
-        t_str = t.end_time_str()
+        t_str = f"{timer.finish():.2f}ms"
         online_users = len(glob.tokens.tokens)
         # yes.
         if userID == 1000:
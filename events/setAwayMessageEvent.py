@@ -22,7 +22,7 @@ def handle(userToken, packetData):
     else:
         fokaMessage = f"Your away message is now: {packetData['awayMessage']}"
     userToken.enqueue(
-        serverPackets.message_notify(glob.BOT_NAME, username, fokaMessage),
+        serverPackets.message_notify(glob.BOT_NAME, username, fokaMessage, 999),
     )
     log.info(
         "{} has changed their away message to: {}".format(
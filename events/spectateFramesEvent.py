@@ -11,7 +11,7 @@ def handle(userToken, packetData):
 
     # Send spectator frames to every spectator
     streamName = f"spect/{userID}"
-    glob.streams.broadcast(streamName, serverPackets.spectator_frames(packetData[7:]))
+    glob.streams.broadcast(streamName, serverPackets.spectator_frames(packetData))
     log.debug(
         "Broadcasting {}'s frames to {} clients".format(
             userID,
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import json
+
+import tornado.gen
+import tornado.web
+from common.web import requestsManager
+
+from handlers import mainHandler
+from helpers import geo_helper
+from helpers import spam_helper
+from objects import glob
+
+
+class handler(requestsManager.asyncRequestHandler):
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def asyncGet(self):
+        statusCode = 400
+        data = {"message": "unknown error"}
+        try:
+            # Get performance stats
+            data["result"] = {
+                "login": {
+                    "phases": glob.login_phases.stats(),
+                    "admission": glob.login_admission.stats(),
+                    "passwordCache": glob.cached_passwords.stats(),
+                    "bcryptPool": glob.bcrypt_pool.stats(),
+                    "geo": geo_helper.locator.stats(),
+                },
+                "writeQueue": glob.write_queue.stats(),
+                "chatLog": glob.chat_log.stats(),
+                "userIDs": glob.user_ids.stats(),
+                "spamThrottled": spam_helper.stats(),
+                "ppLookups": glob.pp_client.stats(),
+                "jobs": glob.scheduler.stats(),
+                "expiry": {
+                    "clients": glob.tokens.timeouts.stats(),
+                    "emptyMatches": glob.matches.emptyTimeouts.stats(),
+                },
+                "compression": mainHandler.getCompressionStats(),
+                "polls": mainHandler.getPollStats(),
+            }
+
+            # Status code and message
+            statusCode = 200
+            data["message"] = "ok"
+        finally:
+            # Add status code to data
+            data["status"] = statusCode
+
+            # Send response
+            self.write(json.dumps(data))
+            self.set_status(statusCode)
@@ -1,7 +1,9 @@
 import datetime
-import gzip
 import sys
+import threading
+import time
 import traceback
+import zlib
 
 import tornado.gen
 import tornado.web
@@ -56,6 +58,7 @@ from events import tournamentJoinMatchChannelEvent
 from events import tournamentLeaveMatchChannelEvent
 from events import beatmapInfoRequest
 from helpers import packetHelper
+from helpers import systemHelper
 from objects import glob
 
 # Placing this here so we do not have to register this every conn.
@@ -119,7 +122,157 @@ eventHandler = {
 }
 
 
+# Response compression.
+# Bigger payloads gain next to nothing from higher gzip levels (presence and
+# chat packets compress to ~10% even at level 1) but cost a lot more CPU,
+# so the level goes down as the payload grows. GZIP_LEVEL is the ceiling.
+SMALL_RESPONSE_SIZE = 1024
+LARGE_RESPONSE_SIZE = 64 * 1024
+
+# Most polls get an empty body back, compress it only once
+cdef bytes EMPTY_GZIP_BODY = zlib.compress(b"", 1, 31)
+
+# Compression stats by response class.
+# Responses are compressed on glob.pool threads, updates go through the lock.
+compressionStats = {
+	responseClass: {"responses": 0, "bytesIn": 0, "bytesOut": 0, "time": 0.0}
+	for responseClass in ("empty", "small", "medium", "large")
+}
+cdef object compressionStatsLock = threading.Lock()
+
+cpdef bytes compressResponse(data):
+	"""
+	Gzip a response body, picking the compression level by its size
+
+	:param data: response body
+	:return: gzipped response body
+	"""
+	cdef Py_ssize_t length = len(data)
+	cdef int level = glob.config.GZIP_LEVEL
+	cdef bytes body
+	cdef dict stats
+	cdef double start, elapsed = 0.0
+
+	if length == 0:
+		body = EMPTY_GZIP_BODY
+		stats = compressionStats["empty"]
+	else:
+		if length < SMALL_RESPONSE_SIZE:
+			stats = compressionStats["small"]
+		elif length < LARGE_RESPONSE_SIZE:
+			level = min(level, 3)
+			stats = compressionStats["medium"]
+		else:
+			level = min(level, 1)
+			stats = compressionStats["large"]
+
+		# A one-shot compress is faster than copying a primed compressor
+		start = time.perf_counter()
+		body = zlib.compress(data, level, 31)
+		elapsed = time.perf_counter() - start
+
+	with compressionStatsLock:
+		stats["responses"] += 1
+		stats["bytesIn"] += length
+		stats["bytesOut"] += len(body)
+		stats["time"] += elapsed
+	return body
+
+def getCompressionStats():
+	"""
+	Get response compression stats, with the average
+	compression time and ratio of each response class
+
+	:return: dict of response class -> stats
+	"""
+	result = {}
+	with compressionStatsLock:
+		snapshot = {
+			responseClass: dict(stats) for responseClass, stats in compressionStats.items()
+		}
+	for responseClass, stats in snapshot.items():
+		responses = stats["responses"]
+		result[responseClass] = {
+			**stats,
+			"avgTime": stats["time"] / responses if responses else 0.0,
+			"ratio": stats["bytesOut"] / stats["bytesIn"] if stats["bytesIn"] else 0.0,
+		}
+	return result
+
+
+# Empty poll fast path.
+# Most requests are a lone ping packet from an idle client with nothing queued,
+# they get the precomputed empty body and headers without going through
+# the packets loop, the processing lock and compression.
+cdef bytes PING_REQUEST = b"\x04\x00\x00\x00\x00\x00\x00"
+
+# Response headers, cho-token aside
+FAST_POLL_HEADERS = (
+	("Vary", "Accept-Encoding"),
+	("Content-Encoding", "gzip"),
+	("cho-protocol", "19"),
+	("Connection", "keep-alive"),
+	("Keep-Alive", "timeout=5, max=100"),
+	("Content-Type", "text/html; charset=UTF-8"),
+)
+
+# Requests with a token, and how many of them took the fast path.
+# Updated from glob.pool threads, through the lock.
+pollStats = {"requests": 0, "fastPath": 0}
+cdef object pollStatsLock = threading.Lock()
+
+def getPollStats():
+	"""
+	Get empty poll fast path stats
+
+	:return: dict with requests count, fast path count and fraction
+	"""
+	with pollStatsLock:
+		stats = dict(pollStats)
+	requests = stats["requests"]
+	return {
+		**stats,
+		"fastPathFraction": stats["fastPath"] / requests if requests else 0.0,
+	}
+
+
+# Retry hint for logins turned away by glob.login_admission,
+# minimum delay in milliseconds and window in seconds.
+LOGIN_RETRY_DELAY = 1000
+LOGIN_RETRY_WINDOW = 4
+
+
 class handler(requestsManager.asyncRequestHandler):
+	@tornado.web.asynchronous
+	@tornado.gen.engine
+	def post(self, *args, **kwargs):
+		# Polls go through the usual background runner
+		if self.request.headers.get("osu-token") is not None:
+			requestsManager.asyncRequestHandler.post(self, *args, **kwargs)
+			return
+
+		# No token, first request. Handle login.
+		# Login is a coroutine running on the IOLoop, its blocking steps
+		# are offloaded to glob.loginPool so other clients keep being served.
+		try:
+			# Only a few logins run at once. If too many are waiting,
+			# tell the client to try again in a few seconds instead.
+			admitted = yield glob.login_admission.acquire()
+			if not admitted:
+				self.writeResponse("", serverPackets.server_restart(
+					systemHelper.reconnectDelay(LOGIN_RETRY_DELAY, LOGIN_RETRY_WINDOW),
+				))
+				return
+
+			try:
+				responseTokenString, responseData = yield loginEvent.handle(self)
+			finally:
+				glob.login_admission.release()
+			self.writeResponse(responseTokenString, responseData)
+		finally:
+			if not self._finished:
+				self.finish()
+
 	@tornado.web.asynchronous
 	@tornado.gen.engine
 	def asyncPost(self):
@@ -128,38 +281,43 @@ class handler(requestsManager.asyncRequestHandler):
 		requestTokenString = self.request.headers.get("osu-token")
 		requestData = self.request.body
 
-		# Server's token string and request data
-		responseTokenString = ""
-		responseData = bytes()
+		if requestTokenString is not None:
+			# Ping only and nothing to send back
+			if requestData == PING_REQUEST:
+				userToken = glob.tokens.tokens.get(requestTokenString)
+				if userToken is not None and not userToken.queue and not userToken.kicked:
+					userToken.updatePingTime()
+					with pollStatsLock:
+						pollStats["requests"] += 1
+						pollStats["fastPath"] += 1
 
-		if requestTokenString is None:
-			# No token, first request. Handle login.
-			responseTokenString, responseData = loginEvent.handle(self)
-		else:
-			userToken = None
-			try:
-				# This is not the first packet, send response based on client's request
-				# Packet start position, used to read stacked packets
-				pos = 0
+					self.write(EMPTY_GZIP_BODY)
+					for name, value in FAST_POLL_HEADERS:
+						self.add_header(name, value)
+					self.add_header("cho-token", userToken.token)
+					return
 
-				# Make sure the token exists
-				if requestTokenString not in glob.tokens.tokens:
-					raise exceptions.tokenNotFoundException()
+			with pollStatsLock:
+				pollStats["requests"] += 1
 
-				# Token exists, get its object and lock it
-				userToken = glob.tokens.tokens[requestTokenString]
-				userToken.processingLock.acquire()
+		# Server's token string and request data
+		responseTokenString = ""
+		responseData = bytes()
 
-				# Keep reading packets until everything has been read
-				while pos < len(requestData):
-					# Get packet from stack starting from new packet
-					leftData = requestData[pos:]
+		userToken = None
+		try:
+			# This is not the first packet, send response based on client's request
+			# Make sure the token exists
+			if requestTokenString not in glob.tokens.tokens:
+				raise exceptions.tokenNotFoundException()
 
-					# Get packet ID, data length and data
-					packetID = packetHelper.readPacketID(leftData)
-					dataLength = packetHelper.readPacketLength(leftData)
-					packetData = requestData[pos:(pos+dataLength+7)]
+			# Token exists, get its object and lock it
+			userToken = glob.tokens.tokens[requestTokenString]
+			userToken.processingLock.acquire()
 
+			# Read stacked packets. Packet data are views over the request body, nothing gets copied
+			try:
+				for packetID, packetData in packetHelper.iterPackets(requestData):
 					# Process/ignore packet
 					if packetID != 4:
 						if packetID in eventHandler:
@@ -169,35 +327,49 @@ class handler(requestsManager.asyncRequestHandler):
 								log.warning("Ignored packet id from {} ({}) (user is restricted)".format(requestTokenString, packetID))
 						else:
 							log.warning("Unknown packet id from {} ({})".format(requestTokenString, packetID))
+			except exceptions.invalidPacketException as e:
+				# Broken frame, ignore the rest of the request
+				log.warning("Invalid packet from {} ({})".format(requestTokenString, e))
 
-					# Update pos so we can read the next stacked packet
-					# +7 because we add packet ID bytes, unused byte and data length bytes
-					pos += dataLength+7
-
-				# Token queue built, send it
-				responseTokenString = userToken.token
-				responseData = userToken.fetch_queue()
-			except exceptions.tokenNotFoundException:
-				# Token not found. Get the user to be reconnected.
+			# Token queue built, send it
+			responseTokenString = userToken.token
+			responseData = userToken.fetch_queue()
+		except exceptions.tokenNotFoundException:
+			# Token not found. Get the user to be reconnected.
+			# Right after a (re)start everyone's token is gone at once,
+			# so spread their reconnections over RECONNECT_WINDOW.
+			if time.time() - glob.startTime < glob.config.RECONNECT_WINDOW:
+				responseData = serverPackets.server_restart(systemHelper.reconnectDelay(1))
+			else:
 				responseData = serverPackets.server_restart(1)
-				responseData += serverPackets.notification("You don't seem to be signed in anymore... This is common during server restarts, trying to log you back in.")
-				log.warning("Received unknown token! This is normal during server restarts. Reconnecting them.")
-			finally:
-				# Unlock token
-				if userToken is not None:
-					# Update ping time for timeout
-					userToken.updatePingTime()
-					# Release processing lock
-					userToken.processingLock.release()
-					# Delete token if kicked
-					if userToken.kicked:
-						glob.tokens.deleteToken(userToken)
+			responseData += serverPackets.notification("You don't seem to be signed in anymore... This is common during server restarts, trying to log you back in.")
+			log.warning("Received unknown token! This is normal during server restarts. Reconnecting them.")
+		finally:
+			# Unlock token
+			if userToken is not None:
+				# Update ping time for timeout
+				userToken.updatePingTime()
+				# Release processing lock
+				userToken.processingLock.release()
+				# Delete token if kicked
+				if userToken.kicked:
+					glob.tokens.deleteToken(userToken)
+
+		self.writeResponse(responseTokenString, responseData)
+
+	def writeResponse(self, responseTokenString, responseData):
+		"""
+		Write a gzipped bancho response and its headers
 
+		:param responseTokenString: token string sent back to the client, empty if login failed
+		:param responseData: response packets
+		:return:
+		"""
 		# Send server's response to client
 		# We don't use token object because we might not have a token (failed login)
 
 		# First, write the gzipped response
-		self.write(gzip.compress(responseData, glob.config.GZIP_LEVEL))
+		self.write(compressResponse(responseData))
 
 		# Then, add gzip headers
 		self.add_header("Vary", "Accept-Encoding")
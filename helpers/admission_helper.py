@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+
+import tornado.gen
+import tornado.locks
+
+
+class LoginAdmission:
+    """Limits how many logins run at once. Logins over the limit wait in a
+    bounded queue, and are turned away if the queue is full or they waited
+    for too long, so a reconnect storm can't pile up on the login path.
+
+    Note:
+        Only used from the IOLoop thread, so no locking is needed.
+    """
+
+    __slots__ = (
+        "_semaphore",
+        "concurrency",
+        "max_queued",
+        "max_wait",
+        "running",
+        "queued",
+        "peak_queued",
+        "admitted",
+        "rejected",
+        "total_wait",
+        "max_wait_seen",
+    )
+
+    def __init__(self, concurrency: int, max_queued: int, max_wait: float) -> None:
+        self._semaphore = tornado.locks.Semaphore(concurrency)
+
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+
+        self.running = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    @tornado.gen.coroutine
+    def acquire(self):
+        """Waits for a login slot. Resolves to True once admitted, or False if
+        the login was turned away. Call `release` after an admitted login."""
+
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            return False
+
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        start = time.perf_counter()
+        try:
+            yield self._semaphore.acquire(timedelta(seconds=self.max_wait))
+        except tornado.gen.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.queued -= 1
+
+        waited = time.perf_counter() - start
+        self.total_wait += waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+        self.admitted += 1
+        self.running += 1
+        return True
+
+    def release(self) -> None:
+        """Frees the slot of an admitted login."""
+
+        self.running -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict[str, float]:
+        """Returns the current and peak queue depth, running logins,
+        admitted and rejected logins and queue wait times."""
+
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait_seen,
+        }
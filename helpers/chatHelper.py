@@ -1,12 +1,9 @@
 from __future__ import annotations
 
-import json
 from typing import Optional
 from typing import TYPE_CHECKING
 from typing import Union
 
-from common.ripple import userUtils
-
 from constants import exceptions
 from constants import serverPackets
 from events import logoutEvent
@@ -187,36 +184,10 @@ def partChannel(
 
 
 def log_message_db(fro: UserToken, to_id: Union[int, str], content: str) -> None:
-    """Logs the message to the database."""
-
-    if isinstance(to_id, str):
-        # Channel Message.
-        glob.db.execute(
-            "INSERT INTO chat_chan_logs (user_id, target_chan, content) VALUES (%s,%s,%s)",
-            (fro.userID, to_id, content),
-        )
-    else:
-        glob.db.execute(
-            "INSERT INTO chat_logs (user_id, target_id, content) VALUES (%s,%s,%s)",
-            (fro.userID, to_id, content),
-        )
+    """Logs the message to the database and notifies the api of it. Both are
+    done in batches in the background by `glob.chat_log`."""
 
-    redis_notify_new_msg(fro.userID, to_id, content)
-
-
-def redis_notify_new_msg(fro: int, to: Union[int, str], content: str) -> None:
-    """Notifies the api of a new message."""
-
-    glob.redis.publish(
-        "rosu:new_message_notify",
-        json.dumps(
-            {
-                "user_id": fro,
-                "target": to,
-                "content": content,
-            },
-        ),
-    )
+    glob.chat_log.log(fro.userID, to_id, content)
 
 
 def sendMessage(fro="", to="", message="", token=None, toIRC=True):
@@ -282,7 +253,12 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
         message = message[:2045] + "..." if len(message) > 2048 else message
 
         # Build packet bytes
-        packet = serverPackets.message_notify(token.username, toClient, message)
+        packet = serverPackets.message_notify(
+            token.username,
+            toClient,
+            message,
+            token.userID,
+        )
 
         # Send the message
         isChannel = to.startswith("#")
@@ -310,7 +286,7 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
             token.addMessageInBuffer(to, message)
 
             # Everything seems fine, build recipients list and send packet
-            glob.streams.broadcast(f"chat/{to}", packet, but=[token.token])
+            glob.streams.broadcast(f"chat/{to}", packet, but={token.token})
             # Log the message to db and api.
             # These channels can overlap and overall are meant to be temporary.
             if toClient not in ("#multiplayer", "#spectator"):
@@ -320,7 +296,7 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
             # Make sure recipient user is connected
             recipientToken = glob.tokens.getTokenFromUsername(to)
             if recipientToken is None:
-                user_id = userUtils.getID(to)
+                user_id = glob.user_ids.get(to)
                 if user_id:
                     log_message_db(token, user_id, message)
                 raise exceptions.userNotFoundException()
@@ -349,7 +325,7 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
 
         # Spam protection (ignore the bot)
         if token.userID > 999 or not token.admin:
-            token.spamProtection()
+            token.spamProtection(to)
 
         # Some bot message
         if isChannel or to.lower() == glob.BOT_NAME.lower():
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Tuple
+from typing import Union
+
+import redis
+
+from logger import log
+from objects import glob
+
+# Rows per multi-row INSERT
+BATCH_SIZE = 500
+
+# (user ID, target channel or user ID, content)
+ChatMessage = Tuple[int, Union[int, str], str]
+
+
+class ChatLogSink:
+    """Buffers chat messages and writes them from a background thread, every
+    `interval` seconds or as soon as `batch_size` are buffered, as multi-row
+    INSERTs into `chat_chan_logs`/`chat_logs` followed by a pipeline of
+    `rosu:new_message_notify` publishes.
+
+    Messages that fail to insert are kept and retried on the next flush.
+    At most `max_retry` are kept, the oldest are dropped past that.
+    """
+
+    __slots__ = (
+        "_messages",
+        "_retry",
+        "_lock",
+        "_flushLock",
+        "_wake",
+        "_stopped",
+        "_thread",
+        "interval",
+        "batch_size",
+        "max_retry",
+        "flushes",
+        "logged",
+        "failures",
+        "dropped",
+        "flush_time",
+        "max_flush_time",
+    )
+
+    def __init__(
+        self,
+        interval: float = 0.2,
+        batch_size: int = 500,
+        max_retry: int = 50_000,
+    ) -> None:
+        self._messages: list[ChatMessage] = []
+        self._retry: deque[ChatMessage] = deque()
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_retry = max_retry
+        self.flushes = 0
+        self.logged = 0
+        self.failures = 0
+        self.dropped = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    def log(self, user_id: int, target: Union[int, str], content: str) -> None:
+        """Buffers a message sent by `user_id` to a channel (str) or user (int)."""
+
+        with self._lock:
+            self._messages.append((user_id, target, content))
+            full = len(self._messages) >= self.batch_size
+
+        if full:
+            self._wake.set()
+
+    @staticmethod
+    def _insert(table: str, column: str, messages: list[ChatMessage]) -> int:
+        """Inserts the messages in chunks, returning how many were written
+        before a chunk failed (all of them if none did)."""
+
+        for i in range(0, len(messages), BATCH_SIZE):
+            chunk = messages[i : i + BATCH_SIZE]
+            try:
+                glob.db.execute(
+                    f"INSERT INTO {table} (user_id, {column}, content) VALUES "
+                    + ", ".join(("(%s,%s,%s)",) * len(chunk)),
+                    [param for message in chunk for param in message],
+                )
+            except Exception:
+                log.error(
+                    f"Failed to log {len(messages) - i} chat messages, retrying later!\n"
+                    + traceback.format_exc(),
+                )
+                return i
+        return len(messages)
+
+    @staticmethod
+    def _notify(messages: list[ChatMessage]) -> None:
+        pipe = glob.redis.pipeline(transaction=False)
+        for user_id, target, content in messages:
+            pipe.publish(
+                "rosu:new_message_notify",
+                json.dumps(
+                    {
+                        "user_id": user_id,
+                        "target": target,
+                        "content": content,
+                    },
+                ),
+            )
+        pipe.execute()
+
+    def _requeue(self, messages: list[ChatMessage]) -> None:
+        self._retry.extend(messages)
+        overflow = len(self._retry) - self.max_retry
+        if overflow > 0:
+            for _ in range(overflow):
+                self._retry.popleft()
+            self.dropped += overflow
+            log.error(f"Chat log retry buffer is full! Dropped {overflow} messages.")
+
+    def flush(self) -> None:
+        """Writes every buffered message, and the ones to retry."""
+
+        with self._flushLock:
+            with self._lock:
+                messages, self._messages = self._messages, []
+            if self._retry:
+                messages = [*self._retry, *messages]
+                self._retry.clear()
+            if not messages:
+                return
+
+            start = time.perf_counter()
+            channel = [message for message in messages if isinstance(message[1], str)]
+            private = [
+                message for message in messages if not isinstance(message[1], str)
+            ]
+            written = []
+
+            for table, column, batch in (
+                ("chat_chan_logs", "target_chan", channel),
+                ("chat_logs", "target_id", private),
+            ):
+                if not batch:
+                    continue
+
+                # Only retry what wasn't written, or it'd be logged twice
+                done = self._insert(table, column, batch)
+                written += batch[:done]
+                if done < len(batch):
+                    self.failures += 1
+                    self._requeue(batch[done:])
+
+            if written:
+                try:
+                    self._notify(written)
+                except redis.RedisError:
+                    self.failures += 1
+                    log.error(
+                        "Failed to notify new messages!\n" + traceback.format_exc()
+                    )
+
+            elapsed = time.perf_counter() - start
+            self.flushes += 1
+            self.logged += len(written)
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.error("Failed to flush chat logs!\n" + traceback.format_exc())
+
+    def start(self) -> None:
+        """Starts flushing in the background."""
+
+        self._thread = threading.Thread(target=self._run, name="chat-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background flushes and writes what's left."""
+
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict[str, float]:
+        """Returns the buffered and to retry messages, flushes, messages
+        logged, failures, drops and the average and max flush time (ms)."""
+
+        return {
+            "buffered": len(self._messages),
+            "retrying": len(self._retry),
+            "flushes": self.flushes,
+            "logged": self.logged,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "avg_flush_ms": (
+                self.flush_time / self.flushes * 1000 if self.flushes else 0.0
+            ),
+            "max_flush_ms": self.max_flush_time * 1000,
+        }
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Hashable
+from typing import Optional
+
+
+class ExpiryHeap:
+    """A min-heap of deadlines by key, so checking for expired keys only
+    touches the ones that are due instead of everything being tracked.
+
+    Rescheduling a key pushes a new entry and leaves the old one in the
+    heap, it's skipped as stale when it comes up. Callers tracking a value
+    that moves often (like a ping time) can also leave the entry alone and
+    check the real deadline when the key expires, scheduling it again if
+    it's not due yet."""
+
+    __slots__ = (
+        "_heap",
+        "_deadlines",
+        "_lock",
+        "_seq",
+        "scheduled",
+        "expired",
+        "stale",
+    )
+
+    def __init__(self) -> None:
+        # (deadline, insertion order, key), the order breaks ties so keys
+        # never get compared.
+        self._heap: list[tuple[float, int, Hashable]] = []
+        # Key -> its current deadline. Heap entries not matching it are stale.
+        self._deadlines: dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+        self.scheduled = 0
+        self.expired = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Sets (or moves) the deadline of the key."""
+
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            self.scheduled += 1
+
+    def cancel(self, key: Hashable) -> None:
+        """Removes the key, if it's scheduled."""
+
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def pop_expired(self, now: Optional[float] = None) -> list[Hashable]:
+        """Removes and returns the keys whose deadline is `now` or earlier,
+        earliest first."""
+
+        if now is None:
+            now = time.time()
+
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) != deadline:
+                    self.stale += 1
+                    continue
+
+                del self._deadlines[key]
+                expired.append(key)
+
+            self.expired += len(expired)
+        return expired
+
+    def next_deadline(self) -> Optional[float]:
+        """Returns the earliest deadline in the heap, None if it's empty.
+        It may belong to a stale entry, so it's a lower bound."""
+
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def stats(self) -> dict[str, int]:
+        """Returns the number of keys and heap entries, and how many keys
+        were scheduled, expired and skipped as stale."""
+
+        return {
+            "size": len(self._deadlines),
+            "entries": len(self._heap),
+            "scheduled": self.scheduled,
+            "expired": self.expired,
+            "stale": self.stale,
+        }
@@ -1,8 +1,25 @@
 from __future__ import annotations
 
+import threading
+from collections import OrderedDict
+from ipaddress import ip_address
+
+import maxminddb
 from geoip2 import database
 
-db_reader = database.Reader("ip_db_2.mmdb")
+
+def _open_reader(path: str) -> database.Reader:
+    """Opens the database memory mapped, through the C extension if it's
+    available. Pages get shared between processes and are loaded on demand
+    rather than reading the whole file into memory."""
+
+    try:
+        return database.Reader(path, mode=maxminddb.MODE_MMAP_EXT)
+    except ValueError:
+        return database.Reader(path, mode=maxminddb.MODE_MMAP)
+
+
+db_reader = _open_reader("ip_db_2.mmdb")
 
 countryCodes = {
     "IO": 104,
@@ -257,6 +274,12 @@ countryCodes = {
     "MH": 138,
 }
 
+# osu country ID -> country letters. Some IDs are shared (eg 0), the first
+# code in `countryCodes` wins, as it did with the old linear lookup.
+countryLetters: dict[int, str] = {}
+for _letters, _id in countryCodes.items():
+    countryLetters.setdefault(_id, _letters)
+
 
 def getCountryID(code):
     """
@@ -277,11 +300,127 @@ def getCountryLetters(code):
     :param code: osu country ID
     :return: country letters (XX if not found)
     """
-    for key, value in countryCodes.items():
-        if value == code:
-            return key
+    return countryLetters.get(code, "XX")
+
+
+def _prefix(ip: str) -> bytes:
+    """Returns the /24 (IPv4) or /48 (IPv6) network of the IP. IPv4 mapped
+    IPv6 addresses (dual stack listeners) get the /24 of their IPv4 address.
+    Raises ValueError if it's not an IP."""
+
+    address = ip_address(ip)
+    if address.version == 6:
+        if address.ipv4_mapped is None:
+            return address.packed[:6]
+        address = address.ipv4_mapped
+    return address.packed[:3]
+
+
+class GeoLocator:
+    """Looks up IP locations with an LRU cache by IP in front of the
+    database, plus one by /24 or /48 network, as addresses in the same
+    network are virtually always in the same place. Repeat logins (eg a
+    reconnect storm after a restart) only cost a dict lookup."""
+
+    __slots__ = (
+        "_reader",
+        "_ips",
+        "_prefixes",
+        "_lock",
+        "max_ips",
+        "max_prefixes",
+        "ip_hits",
+        "prefix_hits",
+        "misses",
+    )
+
+    def __init__(
+        self,
+        reader: database.Reader,
+        max_ips: int = 50_000,
+        max_prefixes: int = 20_000,
+    ) -> None:
+        self._reader = reader
+        self._ips: OrderedDict[str, tuple] = OrderedDict()
+        self._prefixes: OrderedDict[bytes, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.max_ips = max_ips
+        self.max_prefixes = max_prefixes
+        self.ip_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
 
-    return "XX"
+    def _lookup(self, ip: str) -> tuple:
+        try:
+            city = self._reader.city(ip)
+            return (
+                city.location.latitude,
+                city.location.longitude,
+                city.country.iso_code,
+            )
+        except Exception:
+            return 0, 0, "XX"
+
+    @staticmethod
+    def _insert(cache: OrderedDict, key, value: tuple, max_size: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def get_full(self, ip: str) -> tuple:
+        """Returns the `(lat, long, country)` of the IP, `(0, 0, "XX")` if
+        it's unknown or invalid."""
+
+        with self._lock:
+            result = self._ips.get(ip)
+            if result is not None:
+                self._ips.move_to_end(ip)
+                self.ip_hits += 1
+                return result
+
+        try:
+            prefix = _prefix(ip)
+        except ValueError:
+            return 0, 0, "XX"
+
+        with self._lock:
+            result = self._prefixes.get(prefix)
+            if result is not None:
+                self._prefixes.move_to_end(prefix)
+                self._insert(self._ips, ip, result, self.max_ips)
+                self.prefix_hits += 1
+                return result
+
+        # Database lookups are thread safe, no need to hold the lock
+        result = self._lookup(ip)
+
+        with self._lock:
+            self.misses += 1
+            self._insert(self._ips, ip, result, self.max_ips)
+            # Unknown (eg private) addresses say nothing about the rest of
+            # their network
+            if result[2] != "XX":
+                self._insert(self._prefixes, prefix, result, self.max_prefixes)
+        return result
+
+    def stats(self) -> dict[str, float]:
+        """Returns the cache sizes, hits by IP and network, database lookups
+        and the overall hit rate."""
+
+        lookups = self.ip_hits + self.prefix_hits + self.misses
+        return {
+            "ips": len(self._ips),
+            "prefixes": len(self._prefixes),
+            "ip_hits": self.ip_hits,
+            "prefix_hits": self.prefix_hits,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+
+locator = GeoLocator(db_reader)
 
 
 def get_full(ip: str) -> tuple:
@@ -299,10 +438,4 @@ def get_full(ip: str) -> tuple:
             Tuple of data in order of `(lat, long, country)`
     """
 
-    try:
-        city = db_reader.city(ip)
-
-        return city.location.latitude, city.location.longitude, city.country.iso_code
-
-    except Exception:
-        return 0, 0, "XX"
+    return locator.get_full(ip)
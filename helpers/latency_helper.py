@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional
+
+# Upper bounds (ms) of the histogram buckets, anything slower goes in the last one.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """A fixed bucket latency histogram. Cheap to record into and to merge,
+    percentiles are estimated from the bucket upper bounds."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Returns the upper bound of the bucket the percentile falls in,
+        None if it's past the last one."""
+
+        if not self.count:
+            return 0.0
+
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return float(bound)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {
+                **{
+                    f"le_{bound}": count
+                    for bound, count in zip(BUCKETS_MS, self.counts)
+                },
+                "inf": self.counts[-1],
+            },
+        }
+
+
+class PhaseHistograms:
+    """Latency histograms of the phases of an operation (eg login), by name."""
+
+    __slots__ = ("_histograms", "_lock")
+
+    def __init__(self) -> None:
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, ms: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram()
+            histogram.record(ms)
+
+    def timer(self) -> PhaseTimer:
+        """Returns a timer recording into these histograms, started now."""
+
+        return PhaseTimer(self)
+
+    def stats(self) -> dict[str, dict]:
+        """Returns the count, average and p50/p90/p99 (ms) of every phase,
+        along with its bucket counts."""
+
+        with self._lock:
+            return {
+                phase: histogram.stats()
+                for phase, histogram in self._histograms.items()
+            }
+
+
+class PhaseTimer:
+    """Times consecutive phases of a single operation. Every call to `phase`
+    records the time since the previous one (or the start)."""
+
+    __slots__ = ("_histograms", "_start", "_last")
+
+    def __init__(self, histograms: PhaseHistograms) -> None:
+        self._histograms = histograms
+        self._start = self._last = time.perf_counter()
+
+    def phase(self, name: str) -> None:
+        now = time.perf_counter()
+        self._histograms.record(name, (now - self._last) * 1000)
+        self._last = now
+
+    def elapsed(self) -> float:
+        """Returns the time (ms) since the timer started."""
+
+        return (time.perf_counter() - self._start) * 1000
+
+    def finish(self, name: str = "total") -> float:
+        """Records the whole operation's time as `name` and returns it (ms)."""
+
+        elapsed = self.elapsed()
+        self._histograms.record(name, elapsed)
+        return elapsed
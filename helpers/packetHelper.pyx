@@ -1,5 +1,24 @@
 import struct
+from cpython.bytearray cimport PyByteArray_AS_STRING
+from cpython.bytes cimport PyBytes_FromStringAndSize
 from constants import dataTypes
+from constants import exceptions
+
+# Biggest packet data length accepted from a client.
+# Anything bigger is treated as a broken frame.
+MAX_PACKET_LENGTH = 2 * 1024 * 1024
+
+# Precompiled structs
+cdef object _packetHeader = struct.Struct("<HxL")
+cdef object _packetHeaderOut = struct.Struct("<hxl")
+cdef object _byte = struct.Struct("<B")
+cdef object _uInt16 = struct.Struct("<H")
+cdef object _sInt16 = struct.Struct("<h")
+cdef object _uInt32 = struct.Struct("<L")
+cdef object _sInt32 = struct.Struct("<l")
+cdef object _uInt64 = struct.Struct("<Q")
+cdef object _sInt64 = struct.Struct("<q")
+cdef object _float = struct.Struct("<f")
 
 cpdef bytearray uleb128Encode(int num):
 	"""
@@ -139,51 +158,220 @@ cpdef bytes packData(__data, int dataType):
 
 cpdef bytes buildPacket(int __packet, __packetData = None):
 	"""
-	Builds a packet
+	Builds a packet.
+	Kept for packets with a dynamic structure, serverPackets uses PacketWriter directly.
 
 	:param __packet: packet ID
 	:param __packetData: packet structure [[data, dataType], [data, dataType], ...]
 	:return: packet bytes
 	"""
-	# Default argument
-	if __packetData is None:
-		__packetData = []
-	# Set some variables
-	cdef bytes packetData = bytes()
-	cdef int packetLength = 0
-	cdef bytes packetBytes = bytes()
-
-	# Pack packet data
-	for i in __packetData:
-		packetData += packData(i[0], i[1])
-
-	# Set packet length
-	packetLength = len(packetData)
-
-	# Return packet as bytes
-	packetBytes += struct.pack("<h", __packet)		# packet id (int16)
-	packetBytes += bytes(b"\x00")					# unused byte
-	packetBytes += struct.pack("<l", packetLength)	# packet lenght (iint32)
-	packetBytes += packetData						# packet data
-	return packetBytes
-
-cpdef int readPacketID(bytes stream):
+	cdef PacketWriter packet = PacketWriter(__packet)
+	if __packetData is not None:
+		for i in __packetData:
+			packet.write(i[0], i[1])
+	return packet.finish()
+
+
+cdef class PacketWriter:
+	"""
+	Builds a server packet in a single preallocated bytearray.
+	The header is reserved when the writer is created and
+	the packet length is written back in `finish`.
+	"""
+	cdef bytearray buf
+	cdef Py_ssize_t pos
+	cdef readonly int packetID
+
+	def __init__(self, int packetID, Py_ssize_t capacity = 64):
+		"""
+		Create a packet writer
+
+		:param packetID: packet ID
+		:param capacity: expected packet data length. The buffer grows if needed. Default: 64
+		"""
+		self.packetID = packetID
+		self.buf = bytearray(7 + capacity)
+		self.pos = 7
+
+	cdef inline void _reserve(self, Py_ssize_t size) except *:
+		cdef Py_ssize_t capacity = len(self.buf)
+		cdef Py_ssize_t needed = self.pos + size
+		if needed > capacity:
+			self.buf += bytes(max(needed, capacity * 2) - capacity)
+
+	cdef inline void _pack(self, object packer, object value) except *:
+		self._reserve(packer.size)
+		packer.pack_into(self.buf, self.pos, value)
+		self.pos += packer.size
+
+	cpdef writeByte(self, value):
+		self._pack(_byte, value)
+
+	cpdef writeUInt16(self, value):
+		self._pack(_uInt16, value)
+
+	cpdef writeSInt16(self, value):
+		self._pack(_sInt16, value)
+
+	cpdef writeUInt32(self, value):
+		self._pack(_uInt32, value)
+
+	cpdef writeSInt32(self, value):
+		self._pack(_sInt32, value)
+
+	cpdef writeUInt64(self, value):
+		self._pack(_uInt64, value)
+
+	cpdef writeSInt64(self, value):
+		self._pack(_sInt64, value)
+
+	cpdef writeFloat(self, value):
+		self._pack(_float, value)
+
+	cpdef writeBytes(self, data):
+		"""
+		Write raw bytes
+
+		:param data: bytes (or any bytes-like object)
+		"""
+		cdef Py_ssize_t length = len(data)
+		self._reserve(length)
+		self.buf[self.pos:self.pos+length] = data
+		self.pos += length
+
+	cpdef writeString(self, str value):
+		"""
+		Write a bancho string (0x00 if empty, otherwise 0x0b + uleb128 length + utf-8 data)
+
+		:param value: string to write
+		"""
+		cdef bytes encoded
+		cdef Py_ssize_t length
+
+		if len(value) == 0:
+			self._reserve(1)
+			self.buf[self.pos] = 0
+			self.pos += 1
+			return
+
+		encoded = value.encode("utf-8", "ignore")
+		length = len(encoded)
+		# 0x0b, at most 5 uleb128 bytes and the string itself
+		self._reserve(6 + length)
+		self.buf[self.pos] = 11
+		self.pos += 1
+		while True:
+			if length < 128:
+				self.buf[self.pos] = length
+				self.pos += 1
+				break
+			self.buf[self.pos] = (length & 127) | 128
+			self.pos += 1
+			length >>= 7
+		self.buf[self.pos:self.pos+len(encoded)] = encoded
+		self.pos += len(encoded)
+
+	cpdef writeIntList(self, values):
+		"""
+		Write a sInt32 list (uInt16 length first)
+
+		:param values: list of ints
+		"""
+		cdef Py_ssize_t length = len(values)
+		self._reserve(2 + 4*length)
+		struct.pack_into("<H{}l".format(length), self.buf, self.pos, length, *values)
+		self.pos += 2 + 4*length
+
+	cpdef write(self, value, int dataType):
+		"""
+		Write a single value by data type.
+		Slower than the typed write methods, use them when the type is known.
+
+		:param value: value to write
+		:param dataType: data type
+		"""
+		if dataType == dataTypes.BBYTES:
+			self.writeBytes(value)
+		elif dataType == dataTypes.INT_LIST:
+			self.writeIntList(value)
+		elif dataType == dataTypes.STRING:
+			self.writeString(value)
+		elif dataType == dataTypes.UINT16:
+			self.writeUInt16(value)
+		elif dataType == dataTypes.SINT16:
+			self.writeSInt16(value)
+		elif dataType == dataTypes.UINT32:
+			self.writeUInt32(value)
+		elif dataType == dataTypes.SINT32:
+			self.writeSInt32(value)
+		elif dataType == dataTypes.UINT64:
+			self.writeUInt64(value)
+		elif dataType == dataTypes.SINT64:
+			self.writeSInt64(value)
+		elif dataType == dataTypes.FFLOAT:
+			self.writeFloat(value)
+		else:
+			self.writeByte(value)
+
+	cpdef bytes finish(self):
+		"""
+		Write packet ID and length in the reserved header and return the packet
+
+		:return: packet bytes
+		"""
+		_packetHeaderOut.pack_into(self.buf, 0, self.packetID, self.pos - 7)
+		return PyBytes_FromStringAndSize(PyByteArray_AS_STRING(self.buf), self.pos)
+
+cpdef int readPacketID(stream):
 	"""
 	Read packetID (first two bytes) from a packet
 
-	:param stream: packet bytes
+	:param stream: packet bytes (or any bytes-like object)
 	:return: packet ID
 	"""
-	return unpackData(stream[0:2], dataTypes.UINT16)
+	return _packetHeader.unpack_from(stream)[0]
 
-cpdef int readPacketLength(bytes stream):
+cpdef long readPacketLength(stream):
 	"""
 	Read packet data length (3:7 bytes) from a packet
 
-	:param stream: packet bytes
+	:param stream: packet bytes (or any bytes-like object)
 	:return: packet data length
 	"""
-	return unpackData(stream[3:7], dataTypes.UINT32)
+	return _packetHeader.unpack_from(stream)[1]
+
+def iterPackets(requestData):
+	"""
+	Iterate over the stacked packets in a request body without copying it.
+
+	:param requestData: request body bytes (or any bytes-like object)
+	:return: generator of (packetID, packet data memoryview) tuples.
+			Packet data views don't include packetID and length bytes.
+	:raises: exceptions.invalidPacketException if a frame is truncated or too big
+	"""
+	cdef object view = memoryview(requestData)
+	cdef Py_ssize_t total = len(view)
+	cdef Py_ssize_t pos = 0
+	cdef Py_ssize_t end
+	cdef int packetID
+	cdef long dataLength
+
+	while pos < total:
+		# Packet ID (uInt16), unused byte and data length (uInt32)
+		if pos + 7 > total:
+			raise exceptions.invalidPacketException("Truncated packet header at {}".format(pos))
+		packetID, dataLength = _packetHeader.unpack_from(view, pos)
+		if dataLength > MAX_PACKET_LENGTH:
+			raise exceptions.invalidPacketException(
+				"Packet {} is too big ({} bytes)".format(packetID, dataLength)
+			)
+		end = pos + 7 + dataLength
+		if end > total:
+			raise exceptions.invalidPacketException(
+				"Packet {} is truncated ({} bytes, {} left)".format(packetID, dataLength, total - pos - 7)
+			)
+		yield packetID, view[pos+7:end]
+		pos = end
 
 
 cpdef readPacketData(bytes stream, list structure=None, bint hasFirstBytes = True):
@@ -266,3 +454,129 @@ cpdef readPacketData(bytes stream, list structure=None, bint hasFirstBytes = Tru
 			data[i[0]] = unpackData(stream[start:end], i[1])
 
 	return data
+
+
+# Fixed width data types and their struct format characters.
+# Consecutive fixed width fields get merged in a single struct.Struct when compiling a decoder
+cdef dict _fixedFormats = {
+	dataTypes.BYTE: "B",
+	dataTypes.UINT16: "H",
+	dataTypes.SINT16: "h",
+	dataTypes.UINT32: "L",
+	dataTypes.SINT32: "l",
+	dataTypes.UINT64: "Q",
+	dataTypes.SINT64: "q",
+	dataTypes.FFLOAT: "f",
+}
+
+# Decoder step kinds
+cdef enum:
+	STEP_FIXED = 0
+	STEP_STRING = 1
+	STEP_INT_LIST = 2
+
+
+cdef class PacketDecoder:
+	"""
+	A packet structure compiled once to a list of decoding steps.
+	Runs of fixed width fields are read with a single precompiled struct.Struct,
+	strings are decoded with a single latin-1 decode of their slice
+	(same as readPacketData's chr() per byte).
+	Output is the same {name: unpackedValue, ...} dict readPacketData returns.
+	"""
+	cdef list steps
+	cdef readonly list structure
+
+	def __init__(self, list structure):
+		"""
+		Compile a packet structure
+
+		:param structure: packet structure: [[name, dataType], [name, dataType], ...]
+		"""
+		cdef list names = []
+		cdef str fmt = ""
+
+		self.structure = structure
+		self.steps = []
+		for name, dataType in structure:
+			if dataType in _fixedFormats:
+				names.append(name)
+				fmt += _fixedFormats[dataType]
+				continue
+
+			# Variable length field, close current fixed width run
+			if names:
+				self.steps.append((STEP_FIXED, struct.Struct("<" + fmt), tuple(names)))
+				names = []
+				fmt = ""
+			if dataType == dataTypes.STRING:
+				self.steps.append((STEP_STRING, None, name))
+			elif dataType == dataTypes.INT_LIST:
+				self.steps.append((STEP_INT_LIST, None, name))
+			else:
+				raise ValueError("Data type {} can't be decoded".format(dataType))
+		if names:
+			self.steps.append((STEP_FIXED, struct.Struct("<" + fmt), tuple(names)))
+
+	cpdef Py_ssize_t readInto(self, dict data, stream, Py_ssize_t pos):
+		"""
+		Decode `stream` starting from `pos` and put the values in `data`
+
+		:param data: dict the decoded values are written to
+		:param stream: packet bytes (or any bytes-like object)
+		:param pos: position of the first field in `stream`
+		:return: position right after the last decoded field
+		"""
+		cdef int kind, shift, b
+		cdef Py_ssize_t length
+		cdef tuple step
+
+		for step in self.steps:
+			kind = step[0]
+			if kind == STEP_FIXED:
+				data.update(zip(step[2], step[1].unpack_from(stream, pos)))
+				pos += step[1].size
+			elif kind == STEP_STRING:
+				# 0x00 means empty string, 0x0b means uleb128 length + string data
+				b = stream[pos]
+				pos += 1
+				if b == 0:
+					data[step[2]] = ""
+					continue
+				length = 0
+				shift = 0
+				while True:
+					b = stream[pos]
+					pos += 1
+					length |= (<Py_ssize_t>(b & 127)) << shift
+					if b & 128 == 0:
+						break
+					shift += 7
+					# The length comes from the client, more than 5 bytes can't be a valid one
+					if shift > 28:
+						raise struct.error("string field length is too long")
+				if length < 0 or pos + length > len(stream):
+					raise struct.error("string field is longer than the packet")
+				data[step[2]] = str(stream[pos:pos+length], "latin-1")
+				pos += length
+			else:
+				# sInt32 list, uInt16 length first
+				length = _uInt16.unpack_from(stream, pos)[0]
+				pos += 2
+				data[step[2]] = list(struct.unpack_from("<{}l".format(length), stream, pos))
+				pos += 4*length
+
+		return pos
+
+	cpdef dict read(self, stream, bint hasFirstBytes = False):
+		"""
+		Decode packet data from `stream`
+
+		:param stream: packet bytes (or any bytes-like object, like the views from iterPackets)
+		:param hasFirstBytes: 	if True, `stream` has packetID and length bytes.
+								if False, `stream` has only packet data. Default: False
+		:return: {name: unpackedValue, ...}
+		"""
+		cdef dict data = {}
+		self.readInto(data, stream, 7 if hasFirstBytes else 0)
+		return data
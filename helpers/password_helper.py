@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class PasswordCache:
+    """A size and TTL bounded cache of verified passwords, used to skip bcrypt
+    on repeated logins. Stores a salted BLAKE2 digest of the client's password
+    MD5 rather than the MD5 itself."""
+
+    __slots__ = ("_repo", "_lock", "_salt", "max_size", "ttl", "hits", "misses")
+
+    def __init__(self, max_size: int = 10_000, ttl: int = 6 * 60 * 60) -> None:
+        # User ID -> (digest, expiry time), least recently used first.
+        self._repo: OrderedDict[int, tuple[bytes, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Random per process, so digests are useless outside of it.
+        self._salt = os.urandom(hashlib.blake2b.SALT_SIZE)
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._repo)
+
+    def _digest(self, password: str) -> bytes:
+        return hashlib.blake2b(password.encode(), salt=self._salt).digest()
+
+    def check(self, user_id: int, password: str) -> bool:
+        """Checks whether `password` is the cached verified password of the
+        user. Returns False if it doesn't match, or nothing (valid) is cached."""
+
+        digest = self._digest(password)
+        with self._lock:
+            cached = self._repo.get(user_id)
+            if cached is not None and cached[1] < time.time():
+                del self._repo[user_id]
+                cached = None
+
+            if cached is None or not hmac.compare_digest(cached[0], digest):
+                self.misses += 1
+                return False
+
+            self._repo.move_to_end(user_id)
+            self.hits += 1
+            return True
+
+    def insert(self, user_id: int, password: str) -> None:
+        """Caches a verified password for the user, evicting the least
+        recently used entry if the cache is full."""
+
+        digest = self._digest(password)
+        with self._lock:
+            self._repo[user_id] = (digest, time.time() + self.ttl)
+            self._repo.move_to_end(user_id)
+            while len(self._repo) > self.max_size:
+                self._repo.popitem(last=False)
+
+    def evict(self, user_id: int) -> None:
+        """Removes the user's cached password, if any. Call whenever their
+        password changes or they get banned."""
+
+        with self._lock:
+            self._repo.pop(user_id, None)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the cache size, hits and misses."""
+
+        return {"size": len(self._repo), "hits": self.hits, "misses": self.misses}
+
+
+class BcryptPool:
+    """Runs bcrypt checks on a dedicated pool with a capped amount of threads,
+    so a burst of cold logins can't take up every core. Keeps track of how
+    many checks are waiting for a worker."""
+
+    __slots__ = (
+        "_executor",
+        "_lock",
+        "workers",
+        "queued",
+        "running",
+        "peak_queued",
+        "checks",
+    )
+
+    def __init__(self, workers: int) -> None:
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+
+        self.workers = workers
+        self.queued = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.checks = 0
+
+    def _check(self, password: bytes, hashed: bytes) -> bool:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+        try:
+            return bcrypt.checkpw(password, hashed)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.checks += 1
+
+    def check(self, password: bytes, hashed: bytes) -> bool:
+        """Checks a password against a bcrypt hash on the pool, blocking until
+        the result is ready."""
+
+        with self._lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        return self._executor.submit(self._check, password, hashed).result()
+
+    def stats(self) -> dict[str, int]:
+        """Returns the pool size, current queue depth, checks running and
+        the peak queue depth and total checks since startup."""
+
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "peak_queued": self.peak_queued,
+            "checks": self.checks,
+        }
+
+    def shutdown(self) -> None:
+        """Waits for queued checks and stops the pool."""
+
+        self._executor.shutdown(wait=True)
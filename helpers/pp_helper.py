@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+from logger import log
+
+PP_API_URL = "http://localhost:5002/api/v1/pp"
+
+# (beatmap ID, mods, accuracy or -1 for the default accuracies)
+PPKey = Tuple[int, int, float]
+
+# Called with the api's data, or None and an error message for the user
+PPCallback = Callable[[Optional[dict], Optional[str]], None]
+
+# Error messages for the user
+TIMEOUT_ERROR = "Score server API timeout. Please try again in a few seconds."
+API_ERROR = "There has been an exception the in PP API ({})."
+
+
+class PPClient:
+    """Fetches pp values from the LETS api without blocking. Requests go
+    through tornado's pooled async HTTP client on the IOLoop, identical
+    requests in flight are coalesced into one, and results are kept in an
+    LRU cache by (beatmap, mods, acc) for `ttl` seconds."""
+
+    __slots__ = (
+        "_cache",
+        "_pending",
+        "_lock",
+        "_client",
+        "max_size",
+        "ttl",
+        "max_clients",
+        "timeout",
+        "hits",
+        "misses",
+        "coalesced",
+        "errors",
+    )
+
+    def __init__(
+        self,
+        max_size: int = 4096,
+        ttl: int = 10 * 60,
+        max_clients: int = 10,
+        timeout: int = 10,
+    ) -> None:
+        # Key -> (api data, expiry time), least recently used first.
+        self._cache: OrderedDict[PPKey, tuple[dict, float]] = OrderedDict()
+        # Key -> callbacks waiting for the request in flight.
+        self._pending: dict[PPKey, list[PPCallback]] = {}
+        self._lock = threading.Lock()
+        self._client = None
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_clients = max_clients
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def get_cached(self, key: PPKey) -> Optional[dict]:
+        """Returns the cached api data for the key, None if there's none."""
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None or cached[1] < time.time():
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def fetch(self, key: PPKey, callback: PPCallback) -> None:
+        """Requests the api data for the key, calling `callback` on the
+        IOLoop once it's there. Safe to call from any thread."""
+
+        with self._lock:
+            self.misses += 1
+            callbacks = self._pending.get(key)
+            if callbacks is not None:
+                self.coalesced += 1
+                callbacks.append(callback)
+                return
+            self._pending[key] = [callback]
+
+        tornado.ioloop.IOLoop.instance().add_callback(self._request, key)
+
+    @tornado.gen.coroutine
+    def _request(self, key: PPKey):
+        beatmap_id, mods, acc = key
+        url = f"{PP_API_URL}?b={beatmap_id}&m={mods}"
+        if acc != -1:
+            url += f"&a={acc}"
+
+        data = None
+        error = None
+        try:
+            if self._client is None:
+                self._client = tornado.httpclient.AsyncHTTPClient(
+                    max_clients=self.max_clients,
+                )
+            response = yield self._client.fetch(url, request_timeout=self.timeout)
+            data = json.loads(response.body)
+
+            # Make sure status is in response data and is 200
+            if not isinstance(data, dict) or "status" not in data:
+                error = API_ERROR.format("No data from API!")
+            elif data["status"] != 200:
+                error = API_ERROR.format(data.get("message", "unknown error"))
+        except tornado.httpclient.HTTPError as e:
+            # 599 is tornado's code for timeouts and connection errors
+            if e.code == 599:
+                error = TIMEOUT_ERROR
+            else:
+                error = API_ERROR.format(f"HTTP {e.code}")
+        except OSError:
+            error = TIMEOUT_ERROR
+        except ValueError:
+            error = API_ERROR.format("Invalid data from API!")
+        except Exception:
+            log.error(f"Error in a pp lookup ({url})!\n" + traceback.format_exc())
+            error = API_ERROR.format("unknown error")
+
+        with self._lock:
+            callbacks = self._pending.pop(key, ())
+            if error is None:
+                self._cache[key] = (data, time.time() + self.ttl)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+            else:
+                self.errors += 1
+                data = None
+
+        for callback in callbacks:
+            try:
+                callback(data, error)
+            except Exception:
+                log.error("Error in a pp lookup callback!\n" + traceback.format_exc())
+
+    def stats(self) -> dict[str, int]:
+        """Returns the cache size, requests in flight, hits, misses,
+        coalesced requests and errors."""
+
+        return {
+            "size": len(self._cache),
+            "in_flight": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
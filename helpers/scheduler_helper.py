@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import random
+import time
+import traceback
+from typing import Callable
+
+import tornado.ioloop
+
+from logger import log
+
+
+class Job:
+    """A periodic job and its run stats."""
+
+    __slots__ = (
+        "name",
+        "interval",
+        "callback",
+        "jitter",
+        "handle",
+        "runs",
+        "failures",
+        "overruns",
+        "run_time",
+        "max_run_time",
+        "last_run",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        callback: Callable[[], None],
+        jitter: float,
+    ) -> None:
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.jitter = jitter
+        self.handle = None
+
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.run_time = 0.0
+        self.max_run_time = 0.0
+        self.last_run = 0.0
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "avg_ms": self.run_time / self.runs * 1000 if self.runs else 0.0,
+            "max_ms": self.max_run_time * 1000,
+            "last_run": self.last_run,
+        }
+
+
+class Scheduler:
+    """Runs periodic jobs on the IOLoop thread, so they don't race with the
+    handlers running there and need no thread of their own. Every run is
+    delayed by up to `jitter` (fraction of the interval) either way so jobs
+    don't line up. A run taking longer than its interval counts as an
+    overrun, the next one is still scheduled from its end."""
+
+    __slots__ = ("_jobs", "_stopped")
+
+    def __init__(self) -> None:
+        self._jobs: dict[str, Job] = {}
+        self._stopped = False
+
+    def add(
+        self,
+        name: str,
+        interval: float,
+        callback: Callable[[], None],
+        jitter: float = 0.1,
+    ) -> None:
+        """Runs `callback` every `interval` seconds, starting one interval
+        from now."""
+
+        job = self._jobs[name] = Job(name, interval, callback, jitter)
+        self._schedule(job)
+
+    def _schedule(self, job: Job) -> None:
+        delay = job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+        job.handle = tornado.ioloop.IOLoop.instance().call_later(
+            delay,
+            self._run,
+            job,
+        )
+
+    def _run(self, job: Job) -> None:
+        if self._stopped:
+            return
+
+        start = time.perf_counter()
+        try:
+            job.callback()
+        except Exception:
+            job.failures += 1
+            log.error(f"Scheduled job {job.name} failed!\n" + traceback.format_exc())
+        finally:
+            elapsed = time.perf_counter() - start
+            job.runs += 1
+            job.run_time += elapsed
+            job.max_run_time = max(job.max_run_time, elapsed)
+            job.last_run = time.time()
+            if elapsed > job.interval:
+                job.overruns += 1
+
+            if not self._stopped:
+                self._schedule(job)
+
+    def _cancel(self) -> None:
+        ioloop = tornado.ioloop.IOLoop.instance()
+        for job in self._jobs.values():
+            if job.handle is not None:
+                ioloop.remove_timeout(job.handle)
+                job.handle = None
+
+    def stop(self) -> None:
+        """Stops every job. Safe to call from any thread."""
+
+        self._stopped = True
+        tornado.ioloop.IOLoop.instance().add_callback(self._cancel)
+
+    def stats(self) -> dict[str, dict]:
+        """Returns the interval, runs, failures, overruns and the average
+        and max run time (ms) of every job."""
+
+        return {name: job.stats() for name, job in self._jobs.items()}
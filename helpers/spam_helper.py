@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import threading
+import time
+
+# Spam limits by channel class, as (burst, messages refilled per second).
+# Going over a limit gets the user silenced (see UserToken.spamProtection).
+SPAM_LIMITS = {
+    "public": (10, 1.0),
+    "private": (10, 1.0),
+    "multiplayer": (20, 2.0),
+    "spectator": (20, 2.0),
+}
+
+# Throttled messages by channel class. Messages are sent from several
+# threads, use count_throttled to update it.
+throttled = dict.fromkeys(SPAM_LIMITS, 0)
+_throttledLock = threading.Lock()
+
+
+def channel_class(to: str) -> str:
+    """Returns the spam limit class of a message target (internal
+    channel name or username)."""
+
+    if not to.startswith("#"):
+        return "private"
+    if to.startswith("#multi_"):
+        return "multiplayer"
+    if to.startswith("#spect_"):
+        return "spectator"
+    return "public"
+
+
+def count_throttled(spam_class: str) -> None:
+    """Counts a throttled message of the channel class."""
+
+    with _throttledLock:
+        throttled[spam_class] += 1
+
+
+class TokenBucket:
+    """A token bucket, refilled lazily when used rather than on a timer."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: int) -> None:
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, burst: int, rate: float) -> bool:
+        """Takes a token if there's one left. Returns False if the bucket
+        is empty."""
+
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def stats() -> dict[str, int]:
+    """Returns the throttled messages by channel class."""
+
+    with _throttledLock:
+        return dict(throttled)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import math
 import os
+import random
 import signal
 import sys
 import threading
@@ -22,6 +23,24 @@ def dispose():
     :return:
     """
     print("> Disposing server... ")
+
+    # Stop periodic jobs
+    if glob.scheduler is not None:
+        glob.scheduler.stop()
+
+    # Let logins that are still running finish
+    if glob.loginPool is not None:
+        glob.loginPool.shutdown(wait=True)
+    if glob.bcrypt_pool is not None:
+        glob.bcrypt_pool.shutdown()
+
+    # Write what's left in the write-behind queue
+    if glob.write_queue is not None:
+        glob.write_queue.stop()
+
+    # Write the chat logs that are still buffered
+    if glob.chat_log is not None:
+        glob.chat_log.stop()
     log.info(f"Server closing! Bye!")
 
 
@@ -34,6 +53,31 @@ def runningUnderUnix():
     return True if os.name == "posix" else False
 
 
+def reconnectDelay(minDelay, window=None):
+    """
+    Get a random reconnection delay, so clients told to reconnect
+    at the same time don't all come back in the same instant
+
+    :param minDelay: minimum delay in milliseconds
+    :param window: seconds the delays are spread over. Default: RECONNECT_WINDOW
+    :return: delay in milliseconds
+    """
+    if window is None:
+        window = glob.config.RECONNECT_WINDOW
+    return minDelay + random.randint(0, window * 1000)
+
+
+def sendRestartPackets(minDelay):
+    """
+    Send a server restart packet with its own reconnection delay to every client
+
+    :param minDelay: minimum delay in milliseconds
+    :return:
+    """
+    for token in tuple(glob.tokens.tokens.values()):
+        token.enqueue(serverPackets.server_restart(reconnectDelay(minDelay)))
+
+
 def scheduleShutdown(sendRestartTime, restart, message="", delay=20):
     """
     Schedule a server shutdown/restart
@@ -57,12 +101,8 @@ def scheduleShutdown(sendRestartTime, restart, message="", delay=20):
     if message != "":
         glob.streams.broadcast("main", serverPackets.notification(message))
 
-    # Schedule server restart packet
-    threading.Timer(
-        sendRestartTime,
-        glob.streams.broadcast,
-        ["main", serverPackets.server_restart(delay * 2 * 1000)],
-    ).start()
+    # Schedule server restart packets, with reconnections spread over RECONNECT_WINDOW
+    threading.Timer(sendRestartTime, sendRestartPackets, [delay * 2 * 1000]).start()
     glob.restarting = True
 
     # Restart/shutdown
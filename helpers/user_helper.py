@@ -1,7 +1,10 @@
 from __future__ import annotations
 
-import bcrypt
+from typing import Optional
+
+from common.constants import gameModes
 from common.constants import privileges
+from common.ripple import userUtils
 from common.ripple.userUtils import removeFromLeaderboard
 
 from objects import glob
@@ -13,7 +16,11 @@ def username_safe(s: str) -> str:
     return s.lower().strip().replace(" ", "_")
 
 
-def verify_password(user_id: int, password: str) -> bool:
+def verify_password(
+    user_id: int,
+    password: str,
+    passw_db: Optional[str] = None,
+) -> bool:
     """Verifies if the provided username + password combination is correct,
     providing a cache to ensure speed with bcrypt.
 
@@ -24,53 +31,64 @@ def verify_password(user_id: int, password: str) -> bool:
     Args:
         user_id (int): The ID of the user within the database.
         password (str): The user's password hashed with MD5.
+        passw_db (str, optional): The user's bcrypt hash, if already
+            fetched. Fetched from the database if not set.
     """
 
     # Check if we already cached them, for speed benefit.
-    passw = glob.cached_passwords.get(user_id)
-    if passw:
-        return password == passw
+    if glob.cached_passwords.check(user_id, password):
+        return True
 
     # Nope. Sad. Bcrypt time.
-    passw_db = glob.db.fetch(
-        "SELECT password_md5 FROM users WHERE id = %s LIMIT 1",
-        (user_id,),
-    )["password_md5"]
+    if passw_db is None:
+        passw_db = glob.db.fetch(
+            "SELECT password_md5 FROM users WHERE id = %s LIMIT 1",
+            (user_id,),
+        )["password_md5"]
 
-    res = bcrypt.checkpw(password.encode(), passw_db.encode())
+    res = glob.bcrypt_pool.check(password.encode(), passw_db.encode())
     # Cache it for later
     if res:
-        glob.cached_passwords[user_id] = password
+        glob.cached_passwords.insert(user_id, password)
     return res
 
 
-def get_country(user_id: int) -> str:
-    """Returns the country of the user.
-
-    Args:
-        user_id (int): The ID of the user within the database.
-    """
-
-    return glob.db.fetch(
-        "SELECT country FROM users WHERE id = %s LIMIT 1",
-        (user_id,),
-    )["country"]
-
+def fetch_user_data(
+    user_id: Optional[int] = None,
+    safe_username: Optional[str] = None,
+) -> Optional[dict]:
+    """Fetches everything needed to bring a user online in one go, so the
+    token can be created without any I/O of its own.
 
-def set_country(user_id: int, country_code: str) -> None:
-    """Sets the country for a specific user to `country_code`.
+    Note:
+        The result is the user's row (including their password hash and
+            country) plus `stats` for the default game mode and `friends`.
 
     Args:
-        user_id (int): The user ID for the user.
-        country_code (str): The 2 letter country code to set.
-    """
+        user_id (int, optional): The ID of the user within the database.
+        safe_username (str, optional): The safe username of the user, used
+            if `user_id` is not set.
 
-    country_code = country_code.upper()
+    Returns:
+        The user data dict, or `None` if the user doesn't exist.
+    """
 
-    glob.db.execute(
-        "UPDATE users SET country = %s WHERE id = %s LIMIT 1",
-        (country_code, user_id),
+    column, value = (
+        ("id", user_id) if user_id is not None else ("username_safe", safe_username)
     )
+    user_db = glob.db.fetch(
+        "SELECT id, username, username_safe, privileges, silence_end, "
+        "donor_expire, frozen, country, password_md5 FROM users "
+        f"WHERE {column} = %s LIMIT 1",
+        (value,),
+    )
+    if not user_db:
+        return None
+
+    # New tokens always start in std, not relaxing
+    user_db["stats"] = userUtils.getUserStats(user_db["id"], gameModes.STD)
+    user_db["friends"] = userUtils.getFriendList(user_db["id"])
+    return user_db
 
 
 def insert_ban_log(
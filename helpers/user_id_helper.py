@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+from common.ripple import userUtils
+
+from helpers.user_helper import username_safe
+
+
+class UserIDCache:
+    """A size bounded LRU cache of username -> user ID, for the callers that
+    only have a username (eg messages to offline users). Only existing users
+    are cached. Entries must be evicted when a user changes their name."""
+
+    __slots__ = ("_ids", "_names", "_lock", "max_size", "hits", "misses")
+
+    def __init__(self, max_size: int = 10_000) -> None:
+        # Safe username -> user ID, least recently used first.
+        self._ids: OrderedDict[str, int] = OrderedDict()
+        # User ID -> safe username, to evict by ID.
+        self._names: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> int:
+        """Returns the ID of the user, 0 if they don't exist."""
+
+        key = username_safe(username)
+        with self._lock:
+            user_id = self._ids.get(key)
+            if user_id is not None:
+                self._ids.move_to_end(key)
+                self.hits += 1
+                return user_id
+            self.misses += 1
+
+        user_id = userUtils.getID(username)
+        if not user_id:
+            return 0
+
+        with self._lock:
+            stale = self._names.pop(user_id, None)
+            if stale is not None:
+                self._ids.pop(stale, None)
+            self._ids[key] = user_id
+            self._names[user_id] = key
+            while len(self._ids) > self.max_size:
+                _, evicted = self._ids.popitem(last=False)
+                self._names.pop(evicted, None)
+        return user_id
+
+    def evict(self, user_id: int) -> None:
+        """Removes the user's cached name, if any."""
+
+        with self._lock:
+            key = self._names.pop(user_id, None)
+            if key is not None:
+                self._ids.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the cache size, hits and misses."""
+
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any
+
+import redis
+
+from logger import log
+from objects import glob
+
+# Rows per multi-row statement
+BATCH_SIZE = 500
+
+
+class WriteBehindQueue:
+    """Collects fire-and-forget writes from the login and session paths
+    (IP logs, osu! versions, countries and bancho sessions) and flushes them
+    every `interval` seconds from a background thread, as multi-row
+    statements and a single redis pipeline.
+
+    Writes that fail are kept and retried on the next flush, at most
+    `max_retry` of them (the oldest are dropped past that). Memory is
+    bounded by `max_size` too: once that many writes are queued, the
+    flusher is woken up and further writes are dropped until it catches up.
+    """
+
+    __slots__ = (
+        "_ops",
+        "_retry",
+        "_lock",
+        "_flushLock",
+        "_wake",
+        "_stopped",
+        "_thread",
+        "interval",
+        "max_size",
+        "max_retry",
+        "peak_depth",
+        "flushes",
+        "failures",
+        "failed_ops",
+        "dropped",
+        "written",
+        "flush_time",
+        "max_flush_time",
+    )
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        max_size: int = 10_000,
+        max_retry: int = 50_000,
+    ) -> None:
+        # (kind, args) in the order they were queued
+        self._ops: list[tuple[str, tuple]] = []
+        self._retry: deque[tuple[str, tuple]] = deque()
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+        self.interval = interval
+        self.max_size = max_size
+        self.max_retry = max_retry
+        self.peak_depth = 0
+        self.flushes = 0
+        self.failures = 0
+        self.failed_ops = 0
+        self.dropped = 0
+        self.written = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def _push(self, kind: str, *args: Any) -> None:
+        with self._lock:
+            full = len(self._ops) >= self.max_size
+            if full:
+                self.dropped += 1
+            else:
+                self._ops.append((kind, args))
+                self.peak_depth = max(self.peak_depth, len(self._ops))
+
+        # Never flush on the caller's thread, it may be the IOLoop
+        if full:
+            self._wake.set()
+
+    def log_ip(self, user_id: int, ip: str) -> None:
+        """Counts a login of the user from `ip` (`userUtils.logIP`)."""
+
+        self._push("ip", user_id, ip)
+
+    def set_osu_version(self, user_id: int, version: str) -> None:
+        """Sets the user's last used osu! version."""
+
+        self._push("osuver", user_id, version)
+
+    def set_country(self, user_id: int, country_code: str) -> None:
+        """Sets the user's country to the 2 letter `country_code`."""
+
+        self._push("country", user_id, country_code.upper())
+
+    def save_session(self, user_id: int, ip: str) -> None:
+        """Saves a bancho session (`userUtils.saveBanchoSession`)."""
+
+        self._push("session_add", user_id, ip)
+
+    def delete_session(self, user_id: int, ip: str) -> None:
+        """Deletes a bancho session (`userUtils.deleteBanchoSessions`)."""
+
+        self._push("session_del", user_id, ip)
+
+    @staticmethod
+    def _update_case(column: str, values: dict[int, str]) -> None:
+        """Sets `column` of many users at once, from user ID -> value."""
+
+        items = tuple(values.items())
+        for i in range(0, len(items), BATCH_SIZE):
+            chunk = items[i : i + BATCH_SIZE]
+            params = [param for item in chunk for param in item]
+            params += [user_id for user_id, _ in chunk]
+            glob.db.execute(
+                f"UPDATE users SET {column} = CASE id "
+                + "WHEN %s THEN %s " * len(chunk)
+                + f"ELSE {column} END WHERE id IN ("
+                + ", ".join(("%s",) * len(chunk))
+                + ")",
+                params,
+            )
+
+    def _write(self, ops: list[tuple[str, tuple]]) -> list[tuple[str, tuple]]:
+        """Writes the ops, returning the ones that failed."""
+
+        ips = []
+        versions = {}
+        countries = {}
+        sessions = []
+        failed = []
+
+        # Later updates of the same user overwrite earlier ones, session
+        # adds and deletes keep their order
+        for kind, args in ops:
+            if kind == "ip":
+                ips.append(args)
+            elif kind == "osuver":
+                versions[args[0]] = args[1]
+            elif kind == "country":
+                countries[args[0]] = args[1]
+            elif kind in ("session_add", "session_del"):
+                sessions.append((kind, args))
+
+        if sessions:
+            pipe = glob.redis.pipeline(transaction=False)
+            for kind, (user_id, ip) in sessions:
+                if kind == "session_add":
+                    pipe.sadd(f"peppy:sessions:{user_id}", ip)
+                else:
+                    pipe.srem(f"peppy:sessions:{user_id}", ip)
+            try:
+                pipe.execute()
+            except redis.RedisError:
+                log.error("Failed to write bancho sessions!\n" + traceback.format_exc())
+                failed += sessions
+
+        # IP counts aren't idempotent, only retry the chunks not written
+        for i in range(0, len(ips), BATCH_SIZE):
+            chunk = ips[i : i + BATCH_SIZE]
+            try:
+                glob.db.execute(
+                    "INSERT INTO ip_user (userid, ip, occurencies) VALUES "
+                    + ", ".join(("(%s, %s, 1)",) * len(chunk))
+                    + " ON DUPLICATE KEY UPDATE occurencies = occurencies + 1",
+                    [param for row in chunk for param in row],
+                )
+            except Exception:
+                log.error("Failed to log IPs!\n" + traceback.format_exc())
+                failed += [("ip", row) for row in ips[i:]]
+                break
+
+        for kind, values in (("osuver", versions), ("country", countries)):
+            if not values:
+                continue
+            try:
+                self._update_case(kind, values)
+            except Exception:
+                log.error(f"Failed to update {kind}!\n" + traceback.format_exc())
+                failed += [(kind, item) for item in values.items()]
+
+        return failed
+
+    def _requeue(self, ops: list[tuple[str, tuple]]) -> None:
+        self._retry.extend(ops)
+        overflow = len(self._retry) - self.max_retry
+        if overflow > 0:
+            for _ in range(overflow):
+                self._retry.popleft()
+            self.dropped += overflow
+            log.error(f"Write queue retry buffer is full! Dropped {overflow} writes.")
+
+    def flush(self) -> None:
+        """Writes everything queued so far, and the writes to retry."""
+
+        # One flush at a time so writes land in the order they were queued
+        with self._flushLock:
+            with self._lock:
+                ops, self._ops = self._ops, []
+            if self._retry:
+                ops = [*self._retry, *ops]
+                self._retry.clear()
+            if not ops:
+                return
+
+            start = time.perf_counter()
+            failed = self._write(ops)
+            if failed:
+                self.failures += 1
+                self.failed_ops += len(failed)
+                self._requeue(failed)
+
+            elapsed = time.perf_counter() - start
+            self.flushes += 1
+            self.written += len(ops) - len(failed)
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.error("Failed to flush queued writes!\n" + traceback.format_exc())
+
+    def start(self) -> None:
+        """Starts flushing in the background."""
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name="write-behind",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background flushes and writes what's left."""
+
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict[str, float]:
+        """Returns the current and peak queue depth, writes to retry, flush
+        counts, writes, failures, drops and the average and max flush time
+        (ms)."""
+
+        return {
+            "depth": len(self._ops),
+            "peak_depth": self.peak_depth,
+            "retrying": len(self._retry),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+            "failed_ops": self.failed_ops,
+            "dropped": self.dropped,
+            "avg_flush_ms": (
+                self.flush_time / self.flushes * 1000 if self.flushes else 0.0
+            ),
+            "max_flush_ms": self.max_flush_time * 1000,
+        }
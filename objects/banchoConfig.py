@@ -97,6 +97,4 @@ class banchoConfig:
             serverPackets.menu_icon(glob.banchoConf.config["menuIcon"]),
         )
         glob.streams.broadcast("main", serverPackets.channel_info_end())
-        for key, value in glob.channels.channels.items():
-            if value.publicRead and not value.hidden:
-                glob.streams.broadcast("main", serverPackets.channel_info(key))
+        glob.streams.broadcast("main", glob.channels.getInfoBundle())
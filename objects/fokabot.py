@@ -9,7 +9,6 @@ from common.constants import actions
 from common.ripple import userUtils
 
 from constants import fokabotCommands
-from constants import serverPackets
 from logger import log
 from objects import glob
 
@@ -32,8 +31,10 @@ def connect():
     token.timezone = 27
     token.country = 2  # this is retared, fuck it im keeping it as europe, couldnt find the uk as its ordered stupidly
     token.location = (39.01955903386848, 125.75276158057767)  # Pyongyang red square
-    glob.streams.broadcast("main", serverPackets.user_presence(999))
-    glob.streams.broadcast("main", serverPackets.user_stats(999))
+    token.resetPresencePacket()
+    token.resetStatsPacket()
+    glob.streams.broadcast("main", token.getPresencePacket())
+    glob.streams.broadcast("main", token.getStatsPacket())
 
 
 def reload_commands():
@@ -69,16 +70,17 @@ def fokabotResponse(fro, chan, message):
     if fro == glob.BOT_NAME:
         return False
 
-    user = glob.tokens.getTokenFromUsername(fro)
     assert len(message) > 0
 
-    if message[0] not in ("!", "\x01") and not chan.startswith("#"):
-        return DEFAULT_RESPONSE
-
-    for regex, cmd in fokabotCommands.commands.items():
-        if not regex.match(message):
-            continue
+    # Most messages can't be commands, skip them before any lookup
+    if message[0] not in ("!", "\x01"):
+        return False if chan.startswith("#") else DEFAULT_RESPONSE
 
+    # Route by the first words, the regex still has the final say
+    found = fokabotCommands.commandTrie.find(message)
+    if found is not None and found[0].match(message):
+        cmd = found[1]
+        user = glob.tokens.getTokenFromUsername(fro)
         args = message.removeprefix(cmd.trigger).strip().split(" ")
         if cmd.privileges and not user.privileges & cmd.privileges:
             return False
@@ -102,9 +104,7 @@ def fokabotResponse(fro, chan, message):
             log.error(
                 f"There was an issue while running '{cmd.trigger}' command. \nTraceback: {tb}",
             )
-            resp = [
-                "There was issue while processing your command, please report this to a developer.",
-            ]
+            resp = [fokabotCommands.COMMAND_ERROR]
             # Debugging for staff
             if user.admin:
                 resp.append(tb)
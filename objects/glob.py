@@ -11,9 +11,18 @@ from collection.matches import MatchList
 from collection.streams import StreamList
 from collection.tokens import TokenList
 from config import conf
+from helpers.latency_helper import PhaseHistograms
+from helpers.password_helper import PasswordCache
 
 if TYPE_CHECKING:
+    from helpers.admission_helper import LoginAdmission
+    from helpers.chat_log_helper import ChatLogSink
+    from helpers.password_helper import BcryptPool
+    from helpers.pp_helper import PPClient
+    from helpers.scheduler_helper import Scheduler
     from helpers.status_helper import StatusManager
+    from helpers.user_id_helper import UserIDCache
+    from helpers.write_helper import WriteBehindQueue
 
 # Consts.
 DATADOG_PREFIX = "peppy"
@@ -32,9 +41,18 @@ tokens = TokenList()
 channels = ChannelList()
 matches = MatchList()
 verifiedCache = {}
-cached_passwords: dict = {}
+cached_passwords = PasswordCache()
+login_phases = PhaseHistograms()
 chatFilters = None
 pool = None
+loginPool = None
+bcrypt_pool: BcryptPool = None
+login_admission: LoginAdmission = None
+write_queue: WriteBehindQueue = None
+chat_log: ChatLogSink = None
+user_ids: UserIDCache = None
+pp_client: PPClient = None
+scheduler: Scheduler = None
 busyThreads = 0
 
 debug = False
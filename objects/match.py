@@ -7,7 +7,6 @@ import time
 from typing import Optional
 from typing import TYPE_CHECKING
 
-from constants import dataTypes
 from constants import matchModModes
 from constants import matchScoringTypes
 from constants import matchTeams
@@ -19,6 +18,7 @@ from logger import log
 from objects import glob
 
 if TYPE_CHECKING:
+    from helpers.packetHelper import PacketWriter
     from objects.osuToken import UserToken
 
 
@@ -107,43 +107,35 @@ class Match:
             ),
         )
 
-    def getMatchData(self, censored=False) -> bytes:
+    def writeMatchData(self, packet: PacketWriter, censored=False) -> None:
         """
-        Return binary match data structure for packetHelper
-        Return binary match data structure for packetHelper
+        Write binary match data structure to a packet
 
+        :param packet: PacketWriter of the match packet
+        :param censored: if True, replace the match password
         :return:
         """
         # General match info
-        # TODO: Test without safe copy, the error might have been caused by outdated python bytecode cache
-        # safeMatch = copy.deepcopy(self)
-        struct = [
-            [self.matchID, dataTypes.UINT16],
-            [int(self.inProgress), dataTypes.BYTE],
-            [0, dataTypes.BYTE],
-            [self.mods, dataTypes.UINT32],
-            [self.matchName, dataTypes.STRING],
-        ]
+        packet.writeUInt16(self.matchID)
+        packet.writeByte(int(self.inProgress))
+        packet.writeByte(0)
+        packet.writeUInt32(self.mods)
+        packet.writeString(self.matchName)
         if censored and self.matchPassword:
-            struct.append(["RealistikDash was here.", dataTypes.STRING])
+            packet.writeString("RealistikDash was here.")
         else:
-            struct.append([self.matchPassword, dataTypes.STRING])
-
-        struct.extend(
-            [
-                [self.beatmapName, dataTypes.STRING],
-                [self.beatmapID, dataTypes.UINT32],
-                [self.beatmapMD5, dataTypes.STRING],
-            ],
-        )
+            packet.writeString(self.matchPassword)
+        packet.writeString(self.beatmapName)
+        packet.writeUInt32(self.beatmapID)
+        packet.writeString(self.beatmapMD5)
 
         # Slots status IDs, always 16 elements
         for i in range(0, 16):
-            struct.append([self.slots[i].status, dataTypes.BYTE])
+            packet.writeByte(self.slots[i].status)
 
         # Slot teams, always 16 elements
         for i in range(0, 16):
-            struct.append([self.slots[i].team, dataTypes.BYTE])
+            packet.writeByte(self.slots[i].team)
 
         # Slot user ID. Write only if slot is occupied
         for i in range(0, 16):
@@ -151,31 +143,23 @@ class Match:
                 self.slots[i].user is not None
                 and self.slots[i].user in glob.tokens.tokens
             ):
-                struct.append(
-                    [glob.tokens.tokens[self.slots[i].user].userID, dataTypes.UINT32],
-                )
+                packet.writeUInt32(glob.tokens.tokens[self.slots[i].user].userID)
 
         # Other match data
-        struct.extend(
-            [
-                [self.hostUserID, dataTypes.SINT32],
-                [self.gameMode, dataTypes.BYTE],
-                [self.matchScoringType, dataTypes.BYTE],
-                [self.matchTeamType, dataTypes.BYTE],
-                [self.matchModMode, dataTypes.BYTE],
-            ],
-        )
+        packet.writeSInt32(self.hostUserID)
+        packet.writeByte(self.gameMode)
+        packet.writeByte(self.matchScoringType)
+        packet.writeByte(self.matchTeamType)
+        packet.writeByte(self.matchModMode)
 
         # Slot mods if free mod is enabled
         if self.matchModMode == matchModModes.FREE_MOD:
             for i in range(0, 16):
-                struct.append([self.slots[i].mods, dataTypes.UINT32])
+                packet.writeUInt32(self.slots[i].mods)
 
         # Seed idk
         # TODO: Implement this, it should be used for mania "random" mod
-        struct.append([self.seed, dataTypes.UINT32])
-
-        return struct
+        packet.writeUInt32(self.seed)
 
     def setHost(self, newHost: int) -> bool:
         """
@@ -239,6 +223,12 @@ class Match:
         if user != "":
             self.slots[slotID].user = user
 
+            # Keep the empty match cleanup up to date
+            if user is not None:
+                glob.matches.emptyTimeouts.cancel(self.matchID)
+            elif self.countUsers() == 0:
+                glob.matches.scheduleEmpty(self)
+
         if mods is not None:
             self.slots[slotID].mods = mods
 
@@ -15,6 +15,8 @@ from constants import serverPackets
 from constants.rosuprivs import ADMIN_PRIVS
 from events import logoutEvent
 from helpers import chatHelper as chat
+from helpers import spam_helper
+from helpers.spam_helper import TokenBucket
 from logger import log
 from objects import glob
 
@@ -25,7 +27,7 @@ if TYPE_CHECKING:
 class UserToken:
     def __init__(
         self,
-        userID,
+        userData,
         token_=None,
         ip="",
         irc=False,
@@ -33,9 +35,10 @@ class UserToken:
         tournament=False,
     ):
         """
-        Create a token object and set userID and token
+        Create a token object and set userID and token.
+        Doesn't do any I/O, all user data comes from `userData`.
 
-        :param userID: user associated to this token
+        :param userData: user associated to this token, from user_helper.fetch_user_data
         :param token_: 	if passed, set token to that value
                                         if not passed, token will be generated
         :param ip: client ip. optional.
@@ -43,21 +46,22 @@ class UserToken:
         :param timeOffset: the time offset from UTC for this user. Default: 0.
         :param tournament: if True, flag this client as a tournement client. Default: True.
         """
-        # Set stuff
-        self.userID = userID
+        # Cached user presence and stats packets, built on demand. Whatever
+        # changes a field they encode resets them (resetPresencePacket and
+        # resetStatsPacket)
+        self._presencePacket = None
+        self._statsPacket = None
 
-        # Using MySQL over 5 billion SQL queries
-        data_db = glob.db.fetch(
-            "SELECT `username`, `username_safe`, `privileges`, `silence_end` FROM users WHERE id = %s LIMIT 1",
-            (self.userID,),
-        )
-        self.username = data_db["username"]
-        self.safeUsername = data_db["username_safe"]
-        self.privileges = int(data_db["privileges"])
-        self.silenceEndTime = int(data_db["silence_end"])
+        # Set stuff
+        self.userID = userData["id"]
+        self.username = userData["username"]
+        self.safeUsername = userData["username_safe"]
+        self.privileges = int(userData["privileges"])
+        self.silenceEndTime = int(userData["silence_end"])
 
         self.irc = irc
         self.kicked = False
+        self.deleted = False  # Set once removed from the tokens list
         self.loginTime = int(time.time())
         self.pingTime = self.loginTime
         self.timeOffset = timeOffset
@@ -80,11 +84,10 @@ class UserToken:
         self.sentAway = []
         self.matchID = -1
         self.tillerino = [0, 0, -1.0]  # beatmap, mods, acc
-        self.silenceEndTime = 0
-        self.queue = bytearray()
+        self.queue: list[bytes] = []  # Packets to send, joined on fetch
 
-        # Spam protection
-        self.spamRate = 0
+        # Spam protection, channel class -> token bucket
+        self.spamBuckets: dict[str, TokenBucket] = {}
 
         # Stats cache
         self.actionID = actions.IDLE
@@ -118,11 +121,7 @@ class UserToken:
         self._spectLock = threading.RLock()
 
         # Set stats
-        self.updateCachedStats()
-
-        # If we have a valid ip, save bancho session in DB so we can cache LETS logins
-        if ip != "":
-            userUtils.saveBanchoSession(self.userID, self.ip)
+        self.setCachedStats(userData["stats"])
 
         # Join main stream
         self.joinStream("main")
@@ -160,11 +159,16 @@ class UserToken:
         """
 
         # Stop queuing stuff to the bot so we dont run out of mem
-        if self.userID == 999:
+        if self.userID == 999 or not bytes_:
             return
 
+        # Broadcasts share the same packet object between every recipient,
+        # only copy mutable buffers
+        if bytes_.__class__ is not bytes:
+            bytes_ = bytes(bytes_)
+
         with self._bufferLock:
-            self.queue += bytes_
+            self.queue.append(bytes_)
 
     def resetQueue(self) -> None:
         """Resets the queue. Call when enqueued packets have been sent"""
@@ -177,10 +181,10 @@ class UserToken:
         the queue, alongside managing the type."""
 
         with self._bufferLock:
-            b = bytes(self.queue.copy())
-            self.queue.clear()
+            chunks = self.queue
+            self.queue = []
 
-        return b
+        return b"".join(chunks)
 
     def joinChannel(self, channelObject: Channel):
         """
@@ -207,6 +211,61 @@ class UserToken:
         self.joinedChannels.remove(channelObject.name)
         self.leaveStream(f"chat/{channelObject.name}")
 
+    def getPresencePacket(self) -> bytes:
+        """
+        Get the user presence packet of this token, encoding it
+        only if it changed since the last call
+
+        :return: user presence packet
+        """
+        packet = self._presencePacket
+        if isinstance(packet, bytes):
+            return packet
+
+        # Don't cache the result if a field changes while we're encoding
+        marker = self._presencePacket = object()
+        packet = serverPackets.build_user_presence(self)
+        if self._presencePacket is marker:
+            self._presencePacket = packet
+        return packet
+
+    def getStatsPacket(self) -> bytes:
+        """
+        Get the user stats packet of this token, encoding it
+        only if it changed since the last call
+
+        :return: user stats packet
+        """
+        packet = self._statsPacket
+        if isinstance(packet, bytes):
+            return packet
+
+        # Don't cache the result if a field changes while we're encoding
+        marker = self._statsPacket = object()
+        packet = serverPackets.build_user_stats(self)
+        if self._statsPacket is marker:
+            self._statsPacket = packet
+        return packet
+
+    def resetPresencePacket(self) -> None:
+        """
+        Drop the cached user presence packet. Call after changing
+        any field it encodes (username, timeOffset, country, location,
+        privileges or gameRank)
+
+        :return:
+        """
+        self._presencePacket = None
+
+    def resetStatsPacket(self) -> None:
+        """
+        Drop the cached user stats packet. Call after changing any
+        field it encodes (action, gameMode, beatmapID or stats)
+
+        :return:
+        """
+        self._statsPacket = None
+
     def setLocation(self, latitude: float, longitude: float) -> None:
         """
         Set client location
@@ -215,6 +274,7 @@ class UserToken:
         :param longitude: longitude
         """
         self.location = (latitude, longitude)
+        self.resetPresencePacket()
 
     def getLatitude(self) -> float:
         """
@@ -494,19 +554,23 @@ class UserToken:
         # Send silenced packet to everyone else
         glob.streams.broadcast("main", serverPackets.silenced_notify(self.userID))
 
-    def spamProtection(self, increaseSpamRate=True):
+    def spamProtection(self, to):
         """
-        Silences the user if is spamming.
+        Counts a message sent by the user, silencing them if they are spamming.
 
-        :param increaseSpamRate: set to True if the user has sent a new message. Default: True
+        :param to: internal channel name or username the message was sent to
         :return:
         """
-        # Increase the spam rate if needed
-        if increaseSpamRate:
-            self.spamRate += 1
+        spamClass = spam_helper.channel_class(to)
+        burst, rate = spam_helper.SPAM_LIMITS[spamClass]
 
-        # Silence the user if needed
-        if self.spamRate > 10:
+        bucket = self.spamBuckets.get(spamClass)
+        if bucket is None:
+            bucket = self.spamBuckets[spamClass] = TokenBucket(burst)
+
+        # Silence the user if they are over the limit
+        if not bucket.take(burst, rate):
+            spam_helper.count_throttled(spamClass)
             self.silence(1800, "Spamming (auto spam protection)")
 
     def getSilenceSecondsLeft(self):
@@ -526,23 +590,27 @@ class UserToken:
         """
 
         if self.relaxing:
-            stats_relax = userUtils.getUserStatsRx(self.userID, self.gameMode)
-
-            self.gameRank = stats_relax["gameRank"]
-            self.pp = stats_relax["pp"]
-            self.rankedScore = stats_relax["rankedScore"]
-            self.accuracy = stats_relax["accuracy"] / 100
-            self.playcount = stats_relax["playcount"]
-            self.totalScore = stats_relax["totalScore"]
+            stats = userUtils.getUserStatsRx(self.userID, self.gameMode)
         else:
             stats = userUtils.getUserStats(self.userID, self.gameMode)
 
-            self.gameRank = stats["gameRank"]
-            self.pp = stats["pp"]
-            self.rankedScore = stats["rankedScore"]
-            self.accuracy = stats["accuracy"] / 100
-            self.playcount = stats["playcount"]
-            self.totalScore = stats["totalScore"]
+        self.setCachedStats(stats)
+
+    def setCachedStats(self, stats: dict) -> None:
+        """
+        Set all cached stats for this token
+
+        :param stats: stats dict, from userUtils.getUserStats or getUserStatsRx
+        :return:
+        """
+        self.gameRank = stats["gameRank"]
+        self.pp = stats["pp"]
+        self.rankedScore = stats["rankedScore"]
+        self.accuracy = stats["accuracy"] / 100
+        self.playcount = stats["playcount"]
+        self.totalScore = stats["totalScore"]
+        self.resetPresencePacket()
+        self.resetStatsPacket()
 
     def refresh_privs(self) -> None:
         """Fetches the user's privilege group directly from the db and sets
@@ -554,6 +622,8 @@ class UserToken:
                 [self.userID],
             )["privileges"],
         )
+        self.resetPresencePacket()
+        glob.tokens.refreshPresenceBundle(self.userID)
 
     def checkRestricted(self):
         """
@@ -615,7 +685,7 @@ class UserToken:
         :param name: stream name
         :return:
         """
-        glob.streams.join(name, token=self.token)
+        glob.streams.join(name, client=self)
         if name not in self.streams:
             self.streams.append(name)
 
@@ -626,7 +696,7 @@ class UserToken:
         :param name: stream name
         :return:
         """
-        glob.streams.leave(name, token=self.token)
+        glob.streams.leave(name, client=self)
         if name in self.streams:
             self.streams.remove(name)
 
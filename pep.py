@@ -3,6 +3,7 @@ from __future__ import annotations
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import ThreadPool
 
 import redis
@@ -18,13 +19,21 @@ from handlers import apiFokabotMessageHandler
 from handlers import apiIsOnlineHandler
 from handlers import apiOnlineUsersHandler
 from handlers import apiServerStatusHandler
+from handlers import apiStatsHandler
 from handlers import apiUserStatusHandler
 from handlers import apiVerifiedStatusHandler
 from handlers import ciTriggerHandler
 from handlers import mainHandler
 from helpers import consoleHelper
 from helpers import systemHelper as system
+from helpers.admission_helper import LoginAdmission
+from helpers.chat_log_helper import ChatLogSink
+from helpers.password_helper import BcryptPool
+from helpers.pp_helper import PPClient
+from helpers.scheduler_helper import Scheduler
 from helpers.status_helper import StatusManager
+from helpers.user_id_helper import UserIDCache
+from helpers.write_helper import WriteBehindQueue
 from logger import DEBUG
 from logger import log
 from objects import banchoConfig
@@ -48,6 +57,7 @@ def make_app():
             (r"/api/v1/isOnline", apiIsOnlineHandler.handler),
             (r"/api/v1/onlineUsers", apiOnlineUsersHandler.handler),
             (r"/api/v1/serverStatus", apiServerStatusHandler.handler),
+            (r"/api/v1/stats", apiStatsHandler.handler),
             (r"/api/v1/ciTrigger", ciTriggerHandler.handler),
             (r"/api/v1/verifiedStatus", apiVerifiedStatusHandler.handler),
             (r"/api/v1/fokabotMessage", apiFokabotMessageHandler.handler),
@@ -132,6 +142,22 @@ def main():
         try:
             log.info("Creating threads pool... ")
             glob.pool = ThreadPool(glob.config.THREADS_COUNT)
+            glob.loginPool = ThreadPoolExecutor(
+                glob.config.LOGIN_THREADS_COUNT,
+                thread_name_prefix="login",
+            )
+            glob.bcrypt_pool = BcryptPool(glob.config.BCRYPT_THREADS_COUNT)
+            glob.login_admission = LoginAdmission(
+                glob.config.LOGIN_CONCURRENCY,
+                glob.config.LOGIN_QUEUE_SIZE,
+                glob.config.LOGIN_QUEUE_TIMEOUT,
+            )
+            glob.write_queue = WriteBehindQueue()
+            glob.write_queue.start()
+            glob.chat_log = ChatLogSink()
+            glob.chat_log.start()
+            glob.user_ids = UserIDCache()
+            glob.pp_client = PPClient()
             log.info("Complete!")
         except ValueError:
             log.error(
@@ -154,19 +180,12 @@ def main():
         glob.streams.add("lobby")
         log.info("Complete!")
 
-        # Initialize user timeout check loop
-        log.info("Initializing user timeout check loop... ")
-        glob.tokens.usersTimeoutCheckLoop()
-        log.info("Complete!")
-
-        # Initialize spam protection reset loop
-        log.info("Initializing spam protection reset loop... ")
-        glob.tokens.spamProtectionResetLoop()
-        log.info("Complete!")
-
-        # Initialize multiplayer cleanup loop
-        log.info("Initializing multiplayer cleanup loop... ")
-        glob.matches.cleanupLoop()
+        # Schedule periodic jobs, they run on the IOLoop (timed out users are
+        # logged out on the login pool)
+        log.info("Scheduling user timeout check and multiplayer cleanup... ")
+        glob.scheduler = Scheduler()
+        glob.scheduler.add("usersTimeoutCheck", 5, glob.tokens.usersTimeoutCheck)
+        glob.scheduler.add("matchesCleanup", 5, glob.matches.cleanup)
         log.info("Complete!")
 
         try:
@@ -15,6 +15,10 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         userID = super().parseData(userID)
         if userID is None:
             return
+
+        # Banned users shouldn't keep a cached password around
+        glob.cached_passwords.evict(userID)
+
         targetToken = glob.tokens.getTokenFromUserID(userID)
         if targetToken is not None:
             targetToken.checkBanned()
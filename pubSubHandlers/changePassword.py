@@ -19,5 +19,5 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         data = super().parseData(data)
         if data is None:
             return
-        glob.cached_passwords.pop(data["user_id"], None)
+        glob.cached_passwords.evict(data["user_id"])
         log.info(f"Updated password for user ID: {data['user_id']}")
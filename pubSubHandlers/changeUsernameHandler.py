@@ -4,6 +4,7 @@ from common.constants import actions
 from common.redis import generalPubSubHandler
 from common.ripple import userUtils
 
+from helpers.user_helper import username_safe
 from logger import log
 from objects import glob
 
@@ -18,7 +19,13 @@ def handleUsernameChange(userID, newUsername, targetToken=None):
             ),
         )
         userUtils.changeUsername(userID, newUsername=newUsername)
+        glob.user_ids.evict(userID)
         if targetToken is not None:
+            glob.tokens.updateUsername(
+                targetToken,
+                newUsername,
+                username_safe(newUsername),
+            )
             targetToken.kick(
                 "Your username has been changed to {}. Please log in again.".format(
                     newUsername,
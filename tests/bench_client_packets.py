@@ -0,0 +1,71 @@
+"""Microbenchmark of client packet decoding, old readPacketData against the
+compiled PacketDecoders in clientPackets.
+
+Run from the repo root after building the extensions (full_build.sh):
+    python tests/bench_client_packets.py
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import clientPackets  # noqa: E402
+from helpers import packetHelper  # noqa: E402
+from test_client_packets import old_match_settings  # noqa: E402
+from test_client_packets import random_data  # noqa: E402
+from test_client_packets import random_match_settings  # noqa: E402
+from test_client_packets import with_header  # noqa: E402
+
+# Packets of every kind decoded per run
+PACKETS = 1000
+
+# Chat sized strings
+LENGTHS = (0, 8, 16, 32, 64)
+
+
+def bench(name: str, old, new, packets: list[bytes]) -> None:
+    headed = [with_header(data) for data in packets]
+    oldTime = min(timeit.repeat(lambda: [old(p) for p in headed], number=1, repeat=5))
+    newTime = min(timeit.repeat(lambda: [new(p) for p in packets], number=1, repeat=5))
+    print(
+        "{:<20} {:>9.2f}us {:>9.2f}us {:>7.1f}x".format(
+            name,
+            oldTime / len(packets) * 1e6,
+            newTime / len(packets) * 1e6,
+            oldTime / newTime,
+        ),
+    )
+
+
+def main() -> None:
+    r = random.Random(0)
+    print("{:<20} {:>11} {:>11} {:>8}".format("packet", "old", "new", "speedup"))
+    for name in (
+        "_sendPublicMessage",
+        "_sendPrivateMessage",
+        "_userActionChange",
+        "_usersList",
+        "_matchFrames",
+        "_slotID",
+    ):
+        decoder = getattr(clientPackets, name)
+        bench(
+            name[1:],
+            lambda p, s=decoder.structure: packetHelper.readPacketData(p, s),
+            decoder.read,
+            [random_data(r, decoder.structure, LENGTHS) for _ in range(PACKETS)],
+        )
+    bench(
+        "matchSettings",
+        old_match_settings,
+        clientPackets.matchSettings,
+        [random_match_settings(r, LENGTHS) for _ in range(PACKETS)],
+    )
+
+
+if __name__ == "__main__":
+    main()
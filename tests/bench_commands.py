@@ -0,0 +1,130 @@
+"""Throughput of bot command routing on #osu style traffic, the old scan of
+every command regex against the CommandTrie lookup fokabotResponse does.
+Every message is routed both ways and the results must match.
+
+Run from the repo root with the server's config.json in place (the commands
+module imports objects.glob):
+    python tests/bench_commands.py
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import fokabotCommands  # noqa: E402
+
+# Messages replayed per run
+MESSAGES = 10000
+
+# Share of messages that are commands (or look like one)
+COMMAND_SHARE = 0.05
+
+WORDS = (
+    "hello",
+    "gg",
+    "wp",
+    "anyone",
+    "multi",
+    "?",
+    "lol",
+    "nice",
+    "pp",
+    "farm",
+    "map",
+    "this",
+    "is",
+    "so",
+    "hard",
+    "hr",
+    "dt",
+    "fc",
+    "!!!",
+    "héllo",
+    "日本語",
+)
+
+
+def old_route(message: str):
+    """The command the old fokabotResponse picked, by trying every regex."""
+
+    for regex, cmd in fokabotCommands.commands.items():
+        if regex.match(message):
+            return cmd
+    return None
+
+
+def new_route(message: str):
+    """The command fokabotResponse picks now."""
+
+    if message[0] not in ("!", "\x01"):
+        return None
+    found = fokabotCommands.commandTrie.find(message)
+    if found is not None and found[0].match(message):
+        return found[1]
+    return None
+
+
+def chat_message(r: random.Random) -> str:
+    return " ".join(r.choice(WORDS) for _ in range(r.randrange(1, 12)))
+
+
+def command_message(r: random.Random, triggers: list[str]) -> str:
+    kind = r.random()
+    if kind < 0.2:
+        # /np
+        return "\x01ACTION is listening to [https://osu.ppy.sh/b/{} Song]\x01".format(
+            r.randrange(1, 3_000_000),
+        )
+    if kind < 0.3:
+        # Not a command
+        return "!" + chat_message(r)
+    trigger = r.choice(triggers)
+    if r.random() < 0.7:
+        trigger += " " + chat_message(r)
+    return trigger
+
+
+def traffic(r: random.Random) -> list[str]:
+    triggers = [cmd.trigger for cmd in fokabotCommands.commands.values()]
+    return [
+        command_message(r, triggers) if r.random() < COMMAND_SHARE else chat_message(r)
+        for _ in range(MESSAGES)
+    ]
+
+
+def throughput(route, messages: list[str]) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for message in messages:
+            route(message)
+        best = min(best, time.perf_counter() - start)
+    return len(messages) / best
+
+
+def main() -> None:
+    messages = traffic(random.Random(0))
+
+    mismatches = [m for m in messages if old_route(m) is not new_route(m)]
+    routed = sum(new_route(m) is not None for m in messages)
+    print(
+        f"{len(fokabotCommands.commands)} commands, {len(messages)} messages, "
+        f"{routed} routed to a command, {len(mismatches)} mismatches",
+    )
+    for message in mismatches[:10]:
+        print(f"  mismatch: {message!r}")
+
+    for name, route in (("regex scan", old_route), ("trie", new_route)):
+        rate = throughput(route, messages)
+        print(f"{name:<12} {rate / 1000:>9.0f}k msg/s {1e6 / rate:>7.2f}us/msg")
+
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
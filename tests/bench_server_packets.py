@@ -0,0 +1,143 @@
+"""Microbenchmark of server packet building, the old buildPacket (packData
+per field, concatenated) against PacketWriter through serverPackets.
+
+Run from the repo root after building the extensions (full_build.sh):
+    python tests/bench_server_packets.py
+"""
+from __future__ import annotations
+
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import dataTypes  # noqa: E402
+from constants import packetIDs  # noqa: E402
+from helpers import packetHelper  # noqa: E402
+from test_server_packets import fake_token  # noqa: E402
+from test_server_packets import serverPackets  # noqa: E402
+
+# Packets built per run
+PACKETS = 10000
+
+
+def old_build_packet(packetID: int, fields) -> bytes:
+    """buildPacket as it was before PacketWriter, on the compiled packData."""
+
+    packetData = b""
+    for value, dataType in fields:
+        packetData += packetHelper.packData(value, dataType)
+    return (
+        struct.pack("<h", packetID)
+        + b"\x00"
+        + struct.pack("<l", len(packetData))
+        + packetData
+    )
+
+
+def old_user_stats(token) -> bytes:
+    return old_build_packet(
+        packetIDs.server_userStats,
+        (
+            (token.userID, dataTypes.UINT32),
+            (token.actionID, dataTypes.BYTE),
+            (token.actionText, dataTypes.STRING),
+            (token.actionMd5, dataTypes.STRING),
+            (token.actionMods, dataTypes.SINT32),
+            (token.gameMode, dataTypes.BYTE),
+            (token.beatmapID, dataTypes.SINT32),
+            (token.rankedScore, dataTypes.UINT64),
+            (token.accuracy, dataTypes.FFLOAT),
+            (token.playcount, dataTypes.UINT32),
+            (token.totalScore, dataTypes.UINT64),
+            (token.gameRank, dataTypes.UINT32),
+            (token.pp if 65535 >= token.pp > 0 else 0, dataTypes.UINT16),
+        ),
+    )
+
+
+def old_user_presence(token) -> bytes:
+    return old_build_packet(
+        packetIDs.server_userPanel,
+        (
+            (token.userID, dataTypes.SINT32),
+            (token.username, dataTypes.STRING),
+            (24 + token.timeOffset, dataTypes.BYTE),
+            (token.country, dataTypes.BYTE),
+            (1, dataTypes.BYTE),
+            (token.getLongitude(), dataTypes.FFLOAT),
+            (token.getLatitude(), dataTypes.FFLOAT),
+            (token.gameRank, dataTypes.UINT32),
+        ),
+    )
+
+
+def old_message_notify(fro: str, to: str, message: str, fro_id: int) -> bytes:
+    return old_build_packet(
+        packetIDs.server_sendMessage,
+        (
+            (fro, dataTypes.STRING),
+            (message, dataTypes.STRING),
+            (to, dataTypes.STRING),
+            (fro_id, dataTypes.SINT32),
+        ),
+    )
+
+
+def old_match_frames(slotID: int, data) -> bytes:
+    return old_build_packet(
+        packetIDs.server_matchScoreUpdate,
+        (
+            (bytes(data[0:4]), dataTypes.BBYTES),
+            (slotID, dataTypes.BYTE),
+            (bytes(data[5:]), dataTypes.BBYTES),
+        ),
+    )
+
+
+def bench(name: str, old, new, args: list[tuple]) -> None:
+    oldTime = min(timeit.repeat(lambda: [old(*a) for a in args], number=1, repeat=5))
+    newTime = min(timeit.repeat(lambda: [new(*a) for a in args], number=1, repeat=5))
+    print(
+        "{:<16} {:>8.2f}us {:>8.2f}us {:>7.1f}x".format(
+            name,
+            oldTime / len(args) * 1e6,
+            newTime / len(args) * 1e6,
+            oldTime / newTime,
+        ),
+    )
+
+
+def main() -> None:
+    r = random.Random(0)
+    tokens = [(fake_token(r),) for _ in range(PACKETS)]
+    for (token,) in tokens:
+        token.username = token.username[:16]
+        token.actionText = token.actionText[:64]
+    words = ("hello", "gg", "wp", "héllo", "日本語", "!roll", "osu", "fc")
+    messages = [
+        (
+            "FokaBot",
+            "#osu",
+            " ".join(r.choice(words) for _ in range(r.randrange(1, 12))),
+            999,
+        )
+        for _ in range(PACKETS)
+    ]
+    frames = [
+        (r.randrange(16), memoryview(bytes(r.randrange(256) for _ in range(29))))
+        for _ in range(PACKETS)
+    ]
+
+    print("{:<16} {:>10} {:>10} {:>8}".format("packet", "old", "new", "speedup"))
+    bench("user_stats", old_user_stats, serverPackets.build_user_stats, tokens)
+    bench("user_presence", old_user_presence, serverPackets.build_user_presence, tokens)
+    bench("message_notify", old_message_notify, serverPackets.message_notify, messages)
+    bench("match_frames", old_match_frames, serverPackets.match_frames, frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Microbenchmark of stream broadcasts to 1k/5k/20k members, the old list
+of token strings resolved through the tokens dict against Stream's dict of
+token objects. Every member must get the packet both ways.
+
+Run from the repo root with the server's config.json in place (Stream
+imports objects.glob):
+    python tests/bench_streams.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# objects.glob first, objects.stream imports it back
+from objects import glob  # noqa: E402,F401
+from objects.stream import Stream  # noqa: E402
+
+# Stream sizes
+MEMBERS = (1000, 5000, 20000)
+
+# Broadcasts per run
+BROADCASTS = 20
+
+
+class BenchToken:
+    """The token fields broadcast uses, counting enqueued packets."""
+
+    __slots__ = ("token", "deleted", "packets")
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self.deleted = False
+        self.packets = 0
+
+    def enqueue(self, data: bytes) -> None:
+        self.packets += 1
+
+
+def old_broadcast(clients: list[str], tokens: dict, data: bytes, but=None) -> None:
+    """Stream.broadcast as it was before the dict of token objects."""
+
+    if but is None:
+        but = []
+    for token_str in clients:
+        token = tokens.get(token_str)
+        if token and token.token not in but:
+            token.enqueue(data)
+        else:
+            clients.remove(token_str)
+
+
+def main() -> None:
+    print("{:>8} {:>10} {:>10} {:>8}".format("members", "old", "new", "speedup"))
+    failed = False
+    for members in MEMBERS:
+        tokens = {
+            token.token: token
+            for token in (BenchToken(f"token-{i}") for i in range(members))
+        }
+        oldClients = list(tokens)
+        stream = Stream("main")
+        # Straight into the dict, addClient logs every join
+        stream.clients.update(tokens)
+
+        oldTime = min(
+            timeit.repeat(
+                lambda: old_broadcast(oldClients, tokens, b"x"),
+                number=BROADCASTS,
+                repeat=5,
+            ),
+        )
+        newTime = min(
+            timeit.repeat(
+                lambda: stream.broadcast(b"x"),
+                number=BROADCASTS,
+                repeat=5,
+            ),
+        )
+        print(
+            "{:>8} {:>8.2f}ms {:>8.2f}ms {:>7.1f}x".format(
+                members,
+                oldTime / BROADCASTS * 1e3,
+                newTime / BROADCASTS * 1e3,
+                oldTime / newTime,
+            ),
+        )
+
+        # Both ways ran 5 * BROADCASTS times
+        if any(token.packets != 10 * BROADCASTS for token in tokens.values()):
+            print(f"  {members} members: not every member got every packet")
+            failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Microbenchmark of token lookups with 10k users online, the old scan of
+every token against the TokenList userID and username indexes. Every
+lookup is done both ways and the results must match.
+
+Run from the repo root with the server's config.json in place (TokenList
+imports objects.glob):
+    python tests/bench_tokens.py
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# objects.glob first, the modules below import it back
+from objects import glob  # noqa: E402,F401
+from collection.tokens import TokenList  # noqa: E402
+from helpers.user_helper import username_safe  # noqa: E402
+
+# Users online
+TOKENS = 10000
+
+# Lookups per run
+LOOKUPS = 1000
+
+
+class BenchToken:
+    """The token fields the indexes use."""
+
+    __slots__ = ("token", "userID", "username", "safeUsername", "restricted")
+
+    def __init__(self, userID: int) -> None:
+        self.token = f"token-{userID}"
+        self.userID = userID
+        self.username = f"User {userID}"
+        self.safeUsername = username_safe(self.username)
+        self.restricted = False
+
+
+def old_token_from_user_id(tokens: TokenList, userID: int):
+    """getTokenFromUserID as it was before the indexes."""
+
+    userID = int(userID)
+    for value in tokens.tokens.values():
+        if value.userID == userID:
+            return value
+
+
+def old_token_from_username(tokens: TokenList, username: str):
+    """getTokenFromUsername as it was before the indexes."""
+
+    username = username_safe(username)
+    for user in tokens.tokens.values():
+        if user.safeUsername == username:
+            return user
+
+
+def bench(name: str, old, new, args: list) -> None:
+    oldTime = min(timeit.repeat(lambda: [old(a) for a in args], number=1, repeat=5))
+    newTime = min(timeit.repeat(lambda: [new(a) for a in args], number=1, repeat=5))
+    print(
+        "{:<12} {:>9.2f}us {:>9.2f}us {:>7.0f}x".format(
+            name,
+            oldTime / len(args) * 1e6,
+            newTime / len(args) * 1e6,
+            oldTime / newTime,
+        ),
+    )
+
+
+def main() -> None:
+    tokens = TokenList()
+    with tokens:
+        for userID in range(1000, 1000 + TOKENS):
+            token = BenchToken(userID)
+            tokens.tokens[token.token] = token
+            tokens._addToIndexes(token)
+
+    r = random.Random(0)
+    # Offline users included, those scan every token
+    userIDs = [r.randrange(1000, 1000 + TOKENS + TOKENS // 10) for _ in range(LOOKUPS)]
+    usernames = [f"User {userID}" for userID in userIDs]
+
+    mismatches = [
+        userID
+        for userID, username in zip(userIDs, usernames)
+        if old_token_from_user_id(tokens, userID)
+        is not tokens.getTokenFromUserID(userID)
+        or old_token_from_username(tokens, username)
+        is not tokens.getTokenFromUsername(username)
+    ]
+    print(f"{TOKENS} tokens, {LOOKUPS} lookups, {len(mismatches)} mismatches")
+
+    print("{:<12} {:>11} {:>11} {:>8}".format("lookup", "old", "new", "speedup"))
+    bench(
+        "by userID",
+        lambda userID: old_token_from_user_id(tokens, userID),
+        tokens.getTokenFromUserID,
+        userIDs,
+    )
+    bench(
+        "by username",
+        lambda username: old_token_from_username(tokens, username),
+        tokens.getTokenFromUsername,
+        usernames,
+    )
+
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+import os
+import sys
+
+# The tests import the repo's modules (helpers, constants, ...) directly.
+# helpers/packetHelper.pyx has to be built first, see full_build.sh.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
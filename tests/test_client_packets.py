@@ -0,0 +1,191 @@
+"""Parity of the compiled PacketDecoders in clientPackets with the old
+per-field readPacketData decoding, on randomly generated packets."""
+from __future__ import annotations
+
+import random
+import struct
+
+import pytest
+
+from constants import clientPackets
+from constants import dataTypes
+from helpers import packetHelper
+from helpers.packetHelper import PacketDecoder
+
+# Fixed width data types and a function returning a random value for them
+FIXED = {
+    dataTypes.BYTE: ("B", lambda r: r.randrange(1 << 8)),
+    dataTypes.UINT16: ("H", lambda r: r.randrange(1 << 16)),
+    dataTypes.SINT16: ("h", lambda r: r.randrange(-(1 << 15), 1 << 15)),
+    dataTypes.UINT32: ("L", lambda r: r.randrange(1 << 32)),
+    dataTypes.SINT32: ("l", lambda r: r.randrange(-(1 << 31), 1 << 31)),
+    dataTypes.UINT64: ("Q", lambda r: r.randrange(1 << 64)),
+    dataTypes.SINT64: ("q", lambda r: r.randrange(-(1 << 63), 1 << 63)),
+    dataTypes.FFLOAT: ("f", lambda r: r.uniform(-1e6, 1e6)),
+}
+
+# String lengths worth testing: empty, short, and around the uleb128 byte limits
+STRING_LENGTHS = (0, 1, 5, 32, 127, 128, 300, 16384)
+
+# Packets generated per structure
+ROUNDS = 100
+
+
+def random_string(r: random.Random, lengths=STRING_LENGTHS) -> bytes:
+    """Random string data, non-ASCII and control bytes included."""
+
+    return bytes(r.randrange(256) for _ in range(r.choice(lengths)))
+
+
+def encode(dataType: int, value) -> bytes:
+    """Encodes a field the way the client does."""
+
+    if dataType == dataTypes.STRING:
+        if not value:
+            return b"\x00"
+        return b"\x0b" + bytes(packetHelper.uleb128Encode(len(value))) + value
+    if dataType == dataTypes.INT_LIST:
+        return struct.pack(f"<H{len(value)}l", len(value), *value)
+    return struct.pack("<" + FIXED[dataType][0], value)
+
+
+def random_data(r: random.Random, structure: list, lengths=STRING_LENGTHS) -> bytes:
+    """Random packet data (no header) for the structure."""
+
+    data = bytearray()
+    for _, dataType in structure:
+        if dataType == dataTypes.STRING:
+            value = random_string(r, lengths)
+        elif dataType == dataTypes.INT_LIST:
+            value = [FIXED[dataTypes.SINT32][1](r) for _ in range(r.randrange(64))]
+        else:
+            value = FIXED[dataType][1](r)
+        data += encode(dataType, value)
+    return bytes(data)
+
+
+def with_header(data: bytes, packetID: int = 0) -> bytes:
+    return struct.pack("<HxL", packetID, len(data)) + data
+
+
+def random_match_settings(r: random.Random, lengths=STRING_LENGTHS) -> bytes:
+    """Random matchSettings packet data, with user IDs for occupied slots."""
+
+    statuses = [r.choice((1, 2, 4, 8, 16, 32, 64, 128)) for _ in range(16)]
+    data = bytearray(
+        struct.pack("<HBBL", r.randrange(1 << 16), 0, 0, r.randrange(1 << 32)),
+    )
+    for _ in range(3):
+        data += encode(dataTypes.STRING, random_string(r, lengths))
+    data += struct.pack("<L", r.randrange(1 << 32))
+    data += encode(dataTypes.STRING, random_string(r, lengths))
+    data += bytes(statuses)
+    data += bytes(r.randrange(2) for _ in range(16))
+    for status in statuses:
+        if status & (4 | 8 | 16 | 32 | 64):
+            data += struct.pack("<l", FIXED[dataTypes.SINT32][1](r))
+    data += struct.pack("<lBBBB", r.randrange(1 << 31), 0, 0, 1, 0)
+    return bytes(data)
+
+
+def old_match_settings(stream: bytes) -> dict:
+    """matchSettings as it was before PacketDecoder."""
+
+    structure = [
+        ["matchID", dataTypes.UINT16],
+        ["inProgress", dataTypes.BYTE],
+        ["unknown", dataTypes.BYTE],
+        ["mods", dataTypes.UINT32],
+        ["matchName", dataTypes.STRING],
+        ["matchPassword", dataTypes.STRING],
+        ["beatmapName", dataTypes.STRING],
+        ["beatmapID", dataTypes.UINT32],
+        ["beatmapMD5", dataTypes.STRING],
+    ]
+    structure += [[f"slot{i}Status", dataTypes.BYTE] for i in range(16)]
+    structure += [[f"slot{i}Team", dataTypes.BYTE] for i in range(16)]
+    slotData = packetHelper.readPacketData(stream, structure)
+    for i in range(16):
+        if slotData[f"slot{i}Status"] & (4 | 8 | 16 | 32 | 64) > 0:
+            structure.append([f"slot{i}UserId", dataTypes.SINT32])
+    structure += [
+        ["hostUserID", dataTypes.SINT32],
+        ["gameMode", dataTypes.BYTE],
+        ["scoringType", dataTypes.BYTE],
+        ["teamType", dataTypes.BYTE],
+        ["freeMods", dataTypes.BYTE],
+    ]
+    return packetHelper.readPacketData(stream, structure)
+
+
+DECODERS = {
+    name: decoder
+    for name, decoder in vars(clientPackets).items()
+    if isinstance(decoder, PacketDecoder)
+}
+
+
+@pytest.mark.parametrize("name", sorted(DECODERS))
+def test_decoder_matches_readPacketData(name):
+    decoder = DECODERS[name]
+    r = random.Random(name)
+    for _ in range(ROUNDS):
+        data = random_data(r, decoder.structure)
+        expected = packetHelper.readPacketData(with_header(data), decoder.structure)
+
+        assert decoder.read(data) == expected
+        assert decoder.read(memoryview(data)) == expected
+        assert decoder.read(with_header(data), hasFirstBytes=True) == expected
+
+
+def test_match_settings_matches_readPacketData():
+    r = random.Random("matchSettings")
+    for _ in range(ROUNDS):
+        data = random_match_settings(r)
+        expected = old_match_settings(with_header(data))
+
+        assert clientPackets.matchSettings(data) == expected
+        assert clientPackets.matchSettings(memoryview(data)) == expected
+
+
+def test_strings_decode_like_chr_per_byte():
+    data = encode(dataTypes.STRING, "héllo ✓".encode()) + encode(
+        dataTypes.STRING,
+        bytes(range(256)),
+    )
+    decoder = PacketDecoder([["a", dataTypes.STRING], ["b", dataTypes.STRING]])
+
+    assert decoder.read(data) == {
+        "a": "".join(map(chr, "héllo ✓".encode())),
+        "b": "".join(map(chr, range(256))),
+    }
+
+
+def test_truncated_string_raises():
+    data = encode(dataTypes.STRING, b"hello")[:-1]
+
+    with pytest.raises(struct.error):
+        PacketDecoder([["a", dataTypes.STRING]]).read(data)
+
+
+@pytest.mark.parametrize(
+    "length",
+    (
+        # 2**32 - 1, -1 once truncated to 32 bits
+        b"\xff\xff\xff\xff\x0f",
+        # 2**35 - 1, past the packet on 64 bits
+        b"\xff\xff\xff\xff\x7f",
+        # More than 5 length bytes
+        b"\x80\x80\x80\x80\x80\x01",
+        b"\xff" * 64,
+        # Length bytes running past the packet
+        b"\xff\xff",
+    ),
+)
+def test_malformed_string_length_raises(length):
+    data = b"\x0b" + length + b"ABCDEFGH"
+
+    with pytest.raises((struct.error, IndexError)):
+        PacketDecoder(
+            [["a", dataTypes.STRING], ["b", dataTypes.UINT32]],
+        ).read(data)
@@ -0,0 +1,95 @@
+"""GeoLocator caching by IP and network, on a fake database reader."""
+from __future__ import annotations
+
+import types
+from ipaddress import ip_address
+
+import pytest
+from geoip2 import database
+from geoip2.errors import AddressNotFoundError
+
+# geo_helper opens ip_db_2.mmdb when imported, which isn't around in tests
+_realReader = database.Reader
+database.Reader = lambda *args, **kwargs: None
+try:
+    from helpers import geo_helper
+finally:
+    database.Reader = _realReader
+
+
+class FakeReader:
+    """Knows the locations of a few networks, counts lookups."""
+
+    LOCATIONS = {
+        "1.2.3.": (1.0, 2.0, "AU"),
+        "8.8.8.": (3.0, 4.0, "US"),
+        "2001:db8:": (5.0, 6.0, "DE"),
+    }
+
+    def __init__(self) -> None:
+        self.lookups: list[str] = []
+
+    def city(self, ip: str):
+        self.lookups.append(ip)
+        # The database finds IPv4 mapped addresses in the IPv4 tree
+        address = ip_address(ip)
+        if address.version == 6 and address.ipv4_mapped is not None:
+            ip = str(address.ipv4_mapped)
+        for prefix, (latitude, longitude, country) in self.LOCATIONS.items():
+            if ip.startswith(prefix):
+                return types.SimpleNamespace(
+                    location=types.SimpleNamespace(
+                        latitude=latitude,
+                        longitude=longitude,
+                    ),
+                    country=types.SimpleNamespace(iso_code=country),
+                )
+        raise AddressNotFoundError(ip)
+
+
+@pytest.fixture
+def locator():
+    return geo_helper.GeoLocator(FakeReader())
+
+
+def test_same_network_is_cached(locator):
+    assert locator.get_full("1.2.3.4") == (1.0, 2.0, "AU")
+    assert locator.get_full("1.2.3.200") == (1.0, 2.0, "AU")
+    assert locator.get_full("1.2.3.4") == (1.0, 2.0, "AU")
+
+    assert locator._reader.lookups == ["1.2.3.4"]
+    assert (locator.misses, locator.prefix_hits, locator.ip_hits) == (1, 1, 1)
+
+
+def test_ipv4_mapped_addresses_are_keyed_by_their_ipv4_network(locator):
+    assert locator.get_full("::ffff:1.2.3.4") == (1.0, 2.0, "AU")
+    assert locator.get_full("::ffff:8.8.8.8") == (3.0, 4.0, "US")
+    assert locator.get_full("::ffff:8.8.8.4") == (3.0, 4.0, "US")
+    assert locator.get_full("8.8.8.9") == (3.0, 4.0, "US")
+
+    assert locator._reader.lookups == ["::ffff:1.2.3.4", "::ffff:8.8.8.8"]
+
+
+def test_ipv6_network_is_cached(locator):
+    assert locator.get_full("2001:db8::1") == (5.0, 6.0, "DE")
+    assert locator.get_full("2001:db8:0:ffff::2") == (5.0, 6.0, "DE")
+
+    assert locator._reader.lookups == ["2001:db8::1"]
+
+
+@pytest.mark.parametrize("ip", ("", "localhost", "1.2.3", "1.2.3.256", "::ffff:x"))
+def test_invalid_addresses(locator, ip):
+    assert locator.get_full(ip) == (0, 0, "XX")
+    assert locator.get_full(ip) == (0, 0, "XX")
+
+    assert locator._reader.lookups == []
+    assert locator.stats()["ips"] == locator.stats()["prefixes"] == 0
+
+
+def test_unknown_address_doesnt_mark_its_network(locator):
+    assert locator.get_full("192.168.1.1") == (0, 0, "XX")
+    assert locator.get_full("192.168.1.2") == (0, 0, "XX")
+    assert locator.get_full("192.168.1.1") == (0, 0, "XX")
+
+    assert locator._reader.lookups == ["192.168.1.1", "192.168.1.2"]
+    assert locator.stats()["prefixes"] == 0
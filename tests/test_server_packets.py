@@ -0,0 +1,306 @@
+"""Golden tests: packets built with PacketWriter, directly and through
+serverPackets, must be byte for byte the same as the old buildPacket
+output."""
+from __future__ import annotations
+
+import random
+import struct
+import sys
+import types
+
+import pytest
+from common.constants import privileges
+
+from constants import dataTypes
+from constants import packetIDs
+from constants import userRanks
+from constants.rosuprivs import DEV_SUPPORTER
+from constants.rosuprivs import DEVELOPER
+from constants.rosuprivs import MODERATOR
+from constants.rosuprivs import OWNER
+from helpers import packetHelper
+from helpers.packetHelper import PacketWriter
+
+# objects.glob reads config.json and connects to redis when imported,
+# serverPackets only needs BOT_NAME from it to build packets.
+_glob = types.ModuleType("objects.glob")
+_glob.BOT_NAME = "FokaBot"
+_realGlob = sys.modules.get("objects.glob")
+sys.modules["objects.glob"] = _glob
+try:
+    from constants import serverPackets
+finally:
+    if _realGlob is None:
+        del sys.modules["objects.glob"]
+    else:
+        sys.modules["objects.glob"] = _realGlob
+
+
+def old_pack_data(value, dataType: int) -> bytes:
+    """packetHelper.packData as it was before PacketWriter."""
+
+    if dataType == dataTypes.BBYTES:
+        return value
+    if dataType == dataTypes.INT_LIST:
+        data = old_pack_data(len(value), dataTypes.UINT16)
+        for i in value:
+            data += old_pack_data(i, dataTypes.SINT32)
+        return data
+    if dataType == dataTypes.STRING:
+        if len(value) == 0:
+            return b"\x00"
+        encoded = str.encode(value, "utf-8", "ignore")
+        return b"\x0b" + old_uleb128(len(encoded)) + encoded
+    return struct.pack(
+        {
+            dataTypes.UINT16: "<H",
+            dataTypes.SINT16: "<h",
+            dataTypes.UINT32: "<L",
+            dataTypes.SINT32: "<l",
+            dataTypes.UINT64: "<Q",
+            dataTypes.SINT64: "<q",
+            dataTypes.FFLOAT: "<f",
+        }.get(dataType, "<B"),
+        value,
+    )
+
+
+def old_uleb128(num: int) -> bytes:
+    arr = bytearray()
+    if num == 0:
+        return b"\x00"
+    while num > 0:
+        arr.append(num & 127)
+        num >>= 7
+        if num != 0:
+            arr[-1] |= 128
+    return bytes(arr)
+
+
+def old_build_packet(packetID: int, fields) -> bytes:
+    """packetHelper.buildPacket as it was before PacketWriter."""
+
+    data = b"".join(old_pack_data(value, dataType) for value, dataType in fields)
+    return struct.pack("<h", packetID) + b"\x00" + struct.pack("<l", len(data)) + data
+
+
+# Strings worth testing: empty, ASCII, multi-byte utf-8, lone surrogates
+# (encoded to nothing) and lengths around the uleb128 byte limits
+STRINGS = (
+    "",
+    "a",
+    "FokaBot",
+    "héllo wörld",
+    "日本語のチャット",
+    "emoji 🎵🎶",
+    "\ud800",
+    "x" * 127,
+    "x" * 128,
+    "é" * 64,
+    "x" * 16384,
+)
+
+RANDOM_VALUES = {
+    dataTypes.BYTE: lambda r: r.randrange(1 << 8),
+    dataTypes.UINT16: lambda r: r.randrange(1 << 16),
+    dataTypes.SINT16: lambda r: r.randrange(-(1 << 15), 1 << 15),
+    dataTypes.UINT32: lambda r: r.randrange(1 << 32),
+    dataTypes.SINT32: lambda r: r.randrange(-(1 << 31), 1 << 31),
+    dataTypes.UINT64: lambda r: r.randrange(1 << 64),
+    dataTypes.SINT64: lambda r: r.randrange(-(1 << 63), 1 << 63),
+    dataTypes.FFLOAT: lambda r: r.uniform(-1e6, 1e6),
+    dataTypes.STRING: lambda r: r.choice(STRINGS),
+    dataTypes.INT_LIST: lambda r: [
+        r.randrange(-(1 << 31), 1 << 31) for _ in range(r.randrange(64))
+    ],
+    dataTypes.BBYTES: lambda r: bytes(r.randrange(256) for _ in range(r.randrange(64))),
+}
+
+
+def old_user_rank(username: str, userPrivileges: int) -> int:
+    """The username colour rank user_presence sent before PacketWriter."""
+
+    if username == "FokaBot":
+        return userRanks.ADMIN
+    if userPrivileges == OWNER:
+        return userRanks.PEPPY
+    if userPrivileges in (DEVELOPER, DEV_SUPPORTER):
+        return userRanks.ADMIN
+    if userPrivileges == MODERATOR:
+        return userRanks.MOD
+    if userPrivileges & privileges.USER_DONOR:
+        return userRanks.SUPPORTER
+    return userRanks.NORMAL
+
+
+def fake_token(r: random.Random) -> types.SimpleNamespace:
+    """A token with random values for every field the presence and stats
+    packets read."""
+
+    latitude = r.uniform(-90, 90)
+    longitude = r.uniform(-180, 180)
+    return types.SimpleNamespace(
+        userID=r.randrange(1, 1 << 31),
+        username=r.choice(STRINGS[1:]),
+        timeOffset=r.randrange(-12, 13),
+        country=r.randrange(256),
+        gameRank=r.randrange(1 << 32),
+        privileges=r.choice(
+            (
+                OWNER,
+                DEVELOPER,
+                DEV_SUPPORTER,
+                MODERATOR,
+                privileges.USER_NORMAL | privileges.USER_DONOR,
+                r.randrange(1 << 20),
+            ),
+        ),
+        getLatitude=lambda: latitude,
+        getLongitude=lambda: longitude,
+        actionID=r.randrange(256),
+        actionText=r.choice(STRINGS),
+        actionMd5=r.choice(("", "0123456789abcdef0123456789abcdef")),
+        actionMods=r.randrange(-(1 << 31), 1 << 31),
+        gameMode=r.randrange(4),
+        beatmapID=r.randrange(-(1 << 31), 1 << 31),
+        rankedScore=r.randrange(1 << 64),
+        accuracy=r.random(),
+        playcount=r.randrange(1 << 32),
+        totalScore=r.randrange(1 << 64),
+        pp=r.randrange(-10, 70000),
+    )
+
+
+def test_packet_writer_matches_buildPacket():
+    r = random.Random(0)
+    dataTypesList = sorted(RANDOM_VALUES)
+    for _ in range(3000):
+        fields = [
+            (RANDOM_VALUES[dataType](r), dataType)
+            for dataType in r.choices(dataTypesList, k=r.randrange(8))
+        ]
+        packetID = r.randrange(1 << 15)
+        expected = old_build_packet(packetID, fields)
+
+        packet = PacketWriter(packetID, r.choice((0, 1, 64)))
+        for value, dataType in fields:
+            packet.write(value, dataType)
+        assert packet.finish() == expected
+        assert packetHelper.buildPacket(packetID, fields) == expected
+
+
+@pytest.mark.parametrize("value", STRINGS)
+def test_write_string(value):
+    packet = PacketWriter(packetIDs.server_notification, 0)
+    packet.writeString(value)
+
+    assert packet.finish() == old_build_packet(
+        packetIDs.server_notification,
+        [(value, dataTypes.STRING)],
+    )
+
+
+def test_user_presence():
+    r = random.Random(1)
+    for _ in range(200):
+        token = fake_token(r)
+        for username in (token.username, "FokaBot"):
+            token.username = username
+
+            assert serverPackets.build_user_presence(token) == old_build_packet(
+                packetIDs.server_userPanel,
+                (
+                    (token.userID, dataTypes.SINT32),
+                    (username, dataTypes.STRING),
+                    (24 + token.timeOffset, dataTypes.BYTE),
+                    (token.country, dataTypes.BYTE),
+                    (old_user_rank(username, token.privileges), dataTypes.BYTE),
+                    (token.getLongitude(), dataTypes.FFLOAT),
+                    (token.getLatitude(), dataTypes.FFLOAT),
+                    (token.gameRank, dataTypes.UINT32),
+                ),
+            )
+
+
+def test_user_stats():
+    r = random.Random(2)
+    for _ in range(500):
+        token = fake_token(r)
+
+        assert serverPackets.build_user_stats(token) == old_build_packet(
+            packetIDs.server_userStats,
+            (
+                (token.userID, dataTypes.UINT32),
+                (token.actionID, dataTypes.BYTE),
+                (token.actionText, dataTypes.STRING),
+                (token.actionMd5, dataTypes.STRING),
+                (token.actionMods, dataTypes.SINT32),
+                (token.gameMode, dataTypes.BYTE),
+                (token.beatmapID, dataTypes.SINT32),
+                (token.rankedScore, dataTypes.UINT64),
+                (token.accuracy, dataTypes.FFLOAT),
+                (token.playcount, dataTypes.UINT32),
+                (token.totalScore, dataTypes.UINT64),
+                (token.gameRank, dataTypes.UINT32),
+                (token.pp if 65535 >= token.pp > 0 else 0, dataTypes.UINT16),
+            ),
+        )
+
+
+@pytest.mark.parametrize("message", STRINGS[1:])
+def test_message_notify(message):
+    for fro, to, fro_id in (
+        ("FokaBot", "#osu", 999),
+        ("héllo", "日本語", 1000),
+        ("", "", 0),
+    ):
+        assert serverPackets.message_notify(
+            fro,
+            to,
+            message,
+            fro_id,
+        ) == old_build_packet(
+            packetIDs.server_sendMessage,
+            (
+                (fro, dataTypes.STRING),
+                (message, dataTypes.STRING),
+                (to, dataTypes.STRING),
+                (fro_id, dataTypes.SINT32),
+            ),
+        )
+
+
+def test_message_notify_golden():
+    assert serverPackets.message_notify("FokaBot", "#osu", "héllo", 999) == (
+        b"\x07\x00\x00\x1b\x00\x00\x00"
+        b"\x0b\x07FokaBot"
+        b"\x0b\x06h\xc3\xa9llo"
+        b"\x0b\x04#osu"
+        b"\xe7\x03\x00\x00"
+    )
+
+
+def test_match_frames():
+    r = random.Random(3)
+    for _ in range(500):
+        data = bytes(r.randrange(256) for _ in range(29 + r.randrange(2) * 8))
+        slotID = r.randrange(16)
+        expected = old_build_packet(
+            packetIDs.server_matchScoreUpdate,
+            (
+                (data[0:4], dataTypes.BBYTES),
+                (slotID, dataTypes.BYTE),
+                (data[5:], dataTypes.BBYTES),
+            ),
+        )
+
+        assert serverPackets.match_frames(slotID, data) == expected
+        assert serverPackets.match_frames(slotID, memoryview(data)) == expected
+
+
+def test_user_presence_bundle():
+    for userIDs in ([], [1000], list(range(1000, 3000))):
+        assert serverPackets.user_presence_bundle(userIDs) == old_build_packet(
+            packetIDs.server_userPresenceBundle,
+            ((userIDs, dataTypes.INT_LIST),),
+        )